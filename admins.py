@@ -0,0 +1,68 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+ADMIN_STATUSES = ('administrator', 'creator')
+
+
+# Per-chat admin roster cache
+class AdminCache:
+    def __init__(self, ttl=300, max_chats=10000):
+        self.ttl = ttl
+        self.max_chats = max_chats
+        self._rosters = OrderedDict()  # chat_id -> (expires_at, frozenset of admin ids)
+        self._pending = {}  # chat_id -> in-flight refresh task
+        self._generation = 0
+
+    async def is_admin(self, bot, chat_id, user_id):
+        if chat_id > 0:
+            # Private chats have no administrator list
+            chat_member = await bot.get_chat_member(chat_id, user_id)
+            return chat_member.status in ADMIN_STATUSES
+
+        roster = self._get(chat_id)
+        if roster is None:
+            roster = await self._refresh(bot, chat_id)
+        return user_id in roster
+
+    def invalidate(self, chat_id):
+        self._rosters.pop(chat_id, None)
+        self._pending.pop(chat_id, None)
+        self._generation += 1
+
+    def _get(self, chat_id):
+        entry = self._rosters.get(chat_id)
+        if entry is None:
+            return None
+        expires_at, roster = entry
+        if expires_at < time.monotonic():
+            del self._rosters[chat_id]
+            return None
+        self._rosters.move_to_end(chat_id)
+        return roster
+
+    async def _refresh(self, bot, chat_id):
+        # Concurrent misses for the same chat share a single API call
+        task = self._pending.get(chat_id)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(bot, chat_id))
+            self._pending[chat_id] = task
+            task.add_done_callback(lambda done: self._forget(chat_id, done))
+        return await asyncio.shield(task)
+
+    def _forget(self, chat_id, task):
+        if self._pending.get(chat_id) is task:
+            del self._pending[chat_id]
+
+    async def _fetch(self, bot, chat_id):
+        generation = self._generation
+        administrators = await bot.get_chat_administrators(chat_id)
+        roster = frozenset(member.user.id for member in administrators)
+        if generation != self._generation:
+            # A member update arrived while fetching; don't cache a stale roster
+            return roster
+        self._rosters[chat_id] = (time.monotonic() + self.ttl, roster)
+        self._rosters.move_to_end(chat_id)
+        while len(self._rosters) > self.max_chats:
+            self._rosters.popitem(last=False)
+        return roster
@@ -0,0 +1,73 @@
+"""Throughput and memory of FloodDetector at 10k messages/sec.
+
+Replays a simulated stream on a virtual clock: MESSAGES_PER_SEC messages
+spread over many chats and users, with a few flooding users mixed in. It
+reports the per-message cost, how many floods were caught, and the peak
+number of tracked entries and memory, which must stay bounded by idle
+eviction however many distinct users pass through.
+
+Usage: python benchmarks/bench_floods.py [seconds] [messages/sec] [users]
+"""
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from floods import FloodDetector  # noqa: E402
+
+CHATS = 200
+FLOODERS = 20
+
+
+def stream(seconds, rate, users):
+    rng = random.Random(1)
+    flooders = [(-rng.randrange(CHATS) - 1, users + i) for i in range(FLOODERS)]
+    for i in range(seconds * rate):
+        now = i / rate
+        if i % 100 == 0:
+            # Each flooder sends about 5 messages per second
+            chat_id, user_id = flooders[(i // 100) % FLOODERS]
+        else:
+            chat_id, user_id = -rng.randrange(CHATS) - 1, rng.randrange(users)
+        yield chat_id, user_id, now
+
+
+def main():
+    seconds = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    rate = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    users = int(sys.argv[3]) if len(sys.argv) > 3 else 500000
+    events = list(stream(seconds, rate, users))
+
+    detector = FloodDetector(limit=8, window=5.0)
+    peak = 0
+    tracemalloc.start()
+    start = time.perf_counter()
+    for n, (chat_id, user_id, now) in enumerate(events):
+        detector.message(chat_id, user_id, now)
+        if n % 1000 == 0:
+            peak = max(peak, detector.size())
+    elapsed = time.perf_counter() - start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Timing without tracemalloc overhead
+    detector = FloodDetector(limit=8, window=5.0)
+    start = time.perf_counter()
+    for chat_id, user_id, now in events:
+        detector.message(chat_id, user_id, now)
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(events):,} messages ({seconds}s at {rate:,}/s, {users:,} users, {CHATS} chats)")
+    print(f"  {elapsed / len(events) * 1e9:7.0f} ns/message  "
+          f"{len(events) / elapsed:12,.0f} messages/sec  "
+          f"({rate / (len(events) / elapsed) * 100:.1f}% of one core at {rate:,}/s)")
+    print(f"  floods caught {detector.floods} (flooders: {FLOODERS})")
+    print(f"  entries now {detector.size():,}  peak {peak:,}  "
+          f"evicted {detector.evicted:,}  peak memory {peak_memory / 1e6:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Measure ack latency and commit count for warning/ban writes during a raid.
+
+Runs the same burst of update_user_warnings/ban_user/unban_user calls
+through run_db twice: once committing every write (GROUP_COMMIT_OPS=1,
+the old behaviour) and once with the default group commit settings.
+
+Usage: python benchmarks/bench_group_commit.py [writes] [concurrency]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import storage  # noqa: E402
+
+
+async def timed(func, *args):
+    start = time.perf_counter()
+    await storage.run_db(func, *args)
+    return time.perf_counter() - start
+
+
+async def raid(writes, concurrency):
+    latencies = []
+    for base in range(0, writes, concurrency):
+        batch = []
+        for i in range(base, min(base + concurrency, writes)):
+            user_id = i % 500
+            if i % 3 == 0:
+                batch.append(timed(storage.update_user_warnings, -100, user_id, i))
+            elif i % 3 == 1:
+                batch.append(timed(storage.ban_user, -100, user_id, 1))
+            else:
+                batch.append(timed(storage.unban_user, -100, user_id))
+        latencies += await asyncio.gather(*batch)
+    return latencies
+
+
+def run(label, path, group_commit_ops, writes, concurrency):
+    storage.DB_PATH = path
+    storage.GROUP_COMMIT_OPS = group_commit_ops
+    storage.init_db()
+    before = storage.write_stats()
+
+    start = time.perf_counter()
+    latencies = asyncio.run(raid(writes, concurrency))
+    elapsed = time.perf_counter() - start
+    after = storage.write_stats()
+    storage.close_db()
+
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    commits = after['commits'] - before['commits']
+    print(f"{label:<28} {writes / elapsed:>10,.0f} writes/sec  "
+          f"ack p50 {p50:6.2f} ms  p99 {p99:6.2f} ms  commits {commits}")
+
+
+def main():
+    writes = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    default_ops = storage.GROUP_COMMIT_OPS
+
+    with tempfile.TemporaryDirectory() as tmp:
+        run("commit per write", os.path.join(tmp, 'each.db'), 1, writes, concurrency)
+        run("group commit", os.path.join(tmp, 'group.db'), default_ops, writes, concurrency)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+"""Offline benchmark of bot.py's handlers with synthetic updates.
+
+Builds the real Application from bot.build_application() with a recording
+Bot API transport (no network), then replays synthetic updates for each
+scenario: plain text, custom command triggers, /warn replies, captions
+with links, link entities and joins. Every registered handler callback is
+timed, and per-handler throughput and p50/p99 latency are reported along
+with the end-to-end time per scenario and the Bot API calls made.
+
+--save writes the results as a baseline; later runs compare against it and
+exit non-zero when a handler's p50 or p99 grows past --tolerance.
+
+Usage: python benchmarks/bench_handlers.py [--updates N] [--save]
+       [--baseline PATH] [--tolerance 1.5]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baselines', 'handlers.json')
+sys.path.insert(0, ROOT)
+
+BOT_ID = 123456
+ADMIN_ID = 1
+CHATS = 50
+USERS = 1000
+
+# bot.py reads its configuration at import time: no pacing or flood muting
+# in the way of the handlers, and a throwaway database and log file.
+WORKDIR = os.environ.get('BENCH_WORKDIR') or tempfile.mkdtemp(prefix='bench_handlers_')
+os.environ.update({
+    'BENCH_WORKDIR': WORKDIR,
+    'BOT_TOKEN': f'{BOT_ID}:bench',
+    'DB_PATH': os.path.join(WORKDIR, 'bench.db'),
+    'OUTBOUND_RATE': str(10 ** 9),
+    'OUTBOUND_GROUP_RATE': str(10 ** 9),
+    'FLOOD_LIMIT': str(10 ** 9),
+    'RAID_JOINS': str(10 ** 9),
+})
+os.chdir(WORKDIR)
+
+from telegram import Update  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+import bot  # noqa: E402
+import storage  # noqa: E402
+
+
+class RecordingRequest(BaseRequest):
+    def __init__(self):
+        self.calls = Counter()
+        self.message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return 5
+
+    def result(self, endpoint, params):
+        if endpoint == 'getMe':
+            return {'id': BOT_ID, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        if endpoint == 'getChatAdministrators':
+            return [{'status': 'creator', 'is_anonymous': False, 'user': user(ADMIN_ID)}]
+        if endpoint == 'getChatMember':
+            user_id = int(params['user_id'])
+            return {'status': 'creator' if user_id == ADMIN_ID else 'member', 'user': user(user_id)}
+        if endpoint in ('sendMessage', 'copyMessage'):
+            self.message_id += 1
+            return {'message_id': self.message_id, 'date': int(time.time()),
+                    'chat': {'id': int(params['chat_id']), 'type': 'supergroup'},
+                    'text': params.get('text', '')}
+        return True
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        endpoint = url.rsplit('/', 1)[1]
+        params = request_data.parameters if request_data else {}
+        self.calls[endpoint] += 1
+        return 200, json.dumps({'ok': True, 'result': self.result(endpoint, params)}).encode()
+
+
+def user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+
+
+def message(i, chat_id, from_id, **fields):
+    data = {
+        'message_id': i,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'supergroup', 'title': f'Chat {chat_id}'},
+        'from': user(from_id),
+    }
+    data.update(fields)
+    return data
+
+
+def command(text):
+    name = text.split()[0]
+    return {'text': text, 'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(name)}]}
+
+
+# Scenario name -> update builder for the i-th update
+def plain_text(i, chat_id, user_id):
+    return message(i, chat_id, user_id, text=f'just chatting about number {i} with everyone here')
+
+
+def custom_trigger(i, chat_id, user_id):
+    return message(i, chat_id, user_id, text='Hello')
+
+
+def warn_reply(i, chat_id, user_id):
+    target = message(i - 1, chat_id, user_id, text='spam spam spam')
+    return message(i, chat_id, ADMIN_ID, reply_to_message=target, **command('/warn spamming'))
+
+
+def caption_link(i, chat_id, user_id):
+    return message(i, chat_id, user_id, photo=[{'file_id': 'x', 'file_unique_id': 'x', 'width': 1, 'height': 1}],
+                   caption=f'great deals at spam{i}.xyz and docs.example.com today')
+
+
+def link_entity(i, chat_id, user_id):
+    text = f'see https://spam{i}.xyz/offer'
+    url_start = text.index('https')
+    return message(i, chat_id, user_id, text=text, entities=[
+        {'type': 'url', 'offset': url_start, 'length': len(text) - url_start},
+    ])
+
+
+def join(i, chat_id, user_id):
+    return message(i, chat_id, user_id, new_chat_members=[user(user_id)])
+
+
+SCENARIOS = {
+    'plain_text': plain_text,
+    'custom_trigger': custom_trigger,
+    'warn_reply': warn_reply,
+    'caption_link': caption_link,
+    'link_entity': link_entity,
+    'join': join,
+}
+
+
+def instrument(application, timings):
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            callback = handler.callback
+
+            async def timed(update, context, callback=callback, name=callback.__name__):
+                start = time.perf_counter()
+                try:
+                    return await callback(update, context)
+                finally:
+                    timings[name].append(time.perf_counter() - start)
+
+            handler.callback = timed
+
+
+def seed():
+    for n in range(CHATS):
+        chat_id = -1000 - n
+        storage.add_custom_command(chat_id, 'hello', 'Hi there!')
+        storage.set_link_rule(chat_id, 'example.com', True)
+        settings = storage.get_chat_settings(chat_id)
+        settings['welcome_msg'] = 'Welcome {mention} to {title}!'
+        storage.set_chat_settings(chat_id, settings)
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'calls': len(samples),
+        'per_sec': len(samples) / sum(samples),
+        'p50_us': statistics.median(samples) * 1e6,
+        'p99_us': samples[max(int(len(samples) * 0.99) - 1, 0)] * 1e6,
+    }
+
+
+async def run(updates_per_scenario):
+    storage.init_db()
+    await storage.run_db(seed)
+
+    request = RecordingRequest()
+    application = bot.build_application(request=request)
+    timings = defaultdict(list)
+    instrument(application, timings)
+    await application.initialize()
+
+    scenarios = {}
+    for name, build in SCENARIOS.items():
+        # Warm the caches (settings, command index, admin rosters) first
+        for i in range(CHATS):
+            await application.process_update(Update.de_json(
+                {'update_id': i, 'message': build(i + 1, -1000 - i, 100 + i)}, application.bot))
+        for samples in timings.values():
+            samples.clear()
+
+        end_to_end = []
+        calls_before = sum(request.calls.values())
+        for i in range(updates_per_scenario):
+            data = build(i + 1, -1000 - i % CHATS, 100 + i % USERS)
+            update = Update.de_json({'update_id': i, 'message': data}, application.bot)
+            start = time.perf_counter()
+            await application.process_update(update)
+            end_to_end.append(time.perf_counter() - start)
+        scenarios[name] = summarize(end_to_end)
+        scenarios[name]['api_calls'] = sum(request.calls.values()) - calls_before
+        scenarios[name]['handlers'] = {handler: summarize(samples) for handler, samples in timings.items() if samples}
+
+    await bot.post_stop(application)
+    await application.shutdown()
+    await bot.post_shutdown(application)
+    return scenarios, request.calls
+
+
+def report(scenarios, calls):
+    print(f"{'scenario / handler':<34}{'calls':>7}{'per sec':>12}{'p50 us':>10}{'p99 us':>10}")
+    for name, result in scenarios.items():
+        print(f"{name:<34}{result['calls']:>7}{result['per_sec']:>12,.0f}"
+              f"{result['p50_us']:>10.1f}{result['p99_us']:>10.1f}   api calls {result['api_calls']}")
+        for handler, stats in result['handlers'].items():
+            print(f"  {handler:<32}{stats['calls']:>7}{stats['per_sec']:>12,.0f}"
+                  f"{stats['p50_us']:>10.1f}{stats['p99_us']:>10.1f}")
+    print('Bot API calls:', ', '.join(f'{endpoint} {count}' for endpoint, count in calls.most_common()))
+
+
+def compare(scenarios, baseline, tolerance):
+    regressions = []
+    for name, result in scenarios.items():
+        for handler, stats in result['handlers'].items():
+            before = baseline.get(name, {}).get('handlers', {}).get(handler)
+            if before is None:
+                continue
+            for key in ('p50_us', 'p99_us'):
+                if stats[key] > before[key] * tolerance:
+                    regressions.append(f"{name}/{handler} {key} {before[key]:.1f} -> {stats[key]:.1f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark bot.py handlers with synthetic updates')
+    parser.add_argument('--updates', type=int, default=2000, help='updates per scenario')
+    parser.add_argument('--save', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--tolerance', type=float, default=1.5, help='allowed latency ratio to the baseline')
+    args = parser.parse_args()
+
+    scenarios, calls = asyncio.run(run(args.updates))
+    report(scenarios, calls)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(scenarios, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(scenarios, json.load(f), args.tolerance)
+        if regressions:
+            print(f"Regressions (over {args.tolerance}x baseline):")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Micro-benchmark for link detection in the message pipeline's links stage.
+
+Compares the old per-message re.search over the raw pattern string with
+links.find_links, both on messages carrying Telegram's url/text_link
+entities and on bare text that needs the compiled fallback matcher.
+
+Usage: python benchmarks/bench_links.py [rounds]
+"""
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from telegram import Chat, Message, MessageEntity  # noqa: E402
+
+from links import find_links  # noqa: E402
+
+LEGACY_PATTERN = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
+
+# (text, [(linked substring, entity type, text_link url)])
+CORPUS = [
+    ("gm everyone ☀️", []),
+    ("anyone knows when the next meetup is?", []),
+    ("lol that's wild 😂😂", []),
+    ("I pushed the fix, check setup.py and notes.txt", []),
+    ("Price went up 3.5% today, wow", []),
+    ("ok", []),
+    ("Please read the rules before posting. Thanks!", []),
+    ("Join my channel t.me/joinchat/AAAAAEk3hXQm2c0v for free signals",
+     [("t.me/joinchat/AAAAAEk3hXQm2c0v", MessageEntity.URL, None)]),
+    ("🔥 FREE CRYPTO 🔥 https://bit.ly/3xYzAbC claim now!!!",
+     [("https://bit.ly/3xYzAbC", MessageEntity.URL, None)]),
+    ("docs are at https://docs.python.org/3/library/re.html#re.compile",
+     [("https://docs.python.org/3/library/re.html#re.compile", MessageEntity.URL, None)]),
+    ("see www.example.com for details", [("www.example.com", MessageEntity.URL, None)]),
+    ("Click here to win", [("here", MessageEntity.TEXT_LINK, "https://scam.example.xyz/win")]),
+    ("visit example.com/promo today", [("example.com/promo", MessageEntity.URL, None)]),
+    ("ping me at @someone when you're back", [("@someone", MessageEntity.MENTION, None)]),
+    ("Meeting notes: 1) budget 2) roadmap 3) hiring. Long message with a lot of text "
+     "that goes on for a while without any links at all, like most chatter does. " * 3, []),
+]
+
+CHAT = Chat(id=-100123, type=Chat.SUPERGROUP)
+
+
+def utf16_len(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+def build_message(message_id, text, links, with_entities):
+    entities = []
+    if with_entities:
+        for substring, entity_type, url in links:
+            offset = utf16_len(text[:text.index(substring)])
+            entities.append(MessageEntity(entity_type, offset, utf16_len(substring), url=url))
+    return Message(message_id, datetime.now(), CHAT, text=text, entities=entities or None)
+
+
+def run(label, fn, items, rounds):
+    start = time.perf_counter()
+    found = 0
+    for _ in range(rounds):
+        for item in items:
+            if fn(item):
+                found += 1
+    elapsed = time.perf_counter() - start
+    total = rounds * len(items)
+    print(f"{label:<40} {total / elapsed:>12,.0f} msgs/sec  ({found // rounds} of {len(items)} flagged)")
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    texts = [text for text, _ in CORPUS]
+    with_entities = [build_message(i, text, links, True) for i, (text, links) in enumerate(CORPUS)]
+    bare = [build_message(i, text, links, False) for i, (text, links) in enumerate(CORPUS)]
+
+    run("legacy re.search(pattern string)", lambda text: re.search(LEGACY_PATTERN, text), texts, rounds)
+    run("find_links (entities)", find_links, with_entities, rounds)
+    run("find_links (fallback matcher)", find_links, bare, rounds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Throughput of sharded update handling as the number of workers grows.
+
+Forwards a mix of synthetic updates (captions with links, plain text and
+/warn replies over many chats) through ShardedReceiver to 1, 2, 4, ...
+worker processes, each running bot.py's full handler set with the
+recording Bot API transport from bench_handlers.py and one shared SQLite
+database. Reports updates/sec per shard count and the speedup over a single
+worker; scaling is bounded by the number of cores.
+
+Usage: python benchmarks/bench_sharding.py [updates] [max shards]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# bench_handlers sets up the environment bot.py reads (also in the workers)
+from bench_handlers import RecordingRequest, caption_link, plain_text, warn_reply  # noqa: E402
+from telegram import Update  # noqa: E402
+
+import bot  # noqa: E402
+import storage  # noqa: E402
+from sharding import ShardedReceiver, shard_of  # noqa: E402
+
+CHATS = 256
+MIX = (caption_link, caption_link, caption_link, plain_text, plain_text, warn_reply)
+
+
+def build_worker(index, shards):
+    return bot.build_application(request=RecordingRequest(), jobs=False)
+
+
+def make_updates(count):
+    updates = []
+    for i in range(count):
+        build = MIX[i % len(MIX)]
+        data = build(i + 1, -1000 - i % CHATS, 100 + i % 5000)
+        updates.append(Update.de_json({'update_id': i, 'message': data}, None))
+    return updates
+
+
+def run(shards, updates):
+    receiver = ShardedReceiver(build_worker, shards)
+    receiver.start()
+    if not receiver.wait_ready():
+        raise RuntimeError("workers did not start")
+
+    # Same work as ShardedReceiver.forward, without a receiving Application
+    start = time.perf_counter()
+    for update in updates:
+        receiver.queues[shard_of(update, shards)].put(update.to_dict())
+    receiver.stop()
+    return time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    max_shards = int(sys.argv[2]) if len(sys.argv) > 2 else max(os.cpu_count() or 1, 4)
+
+    storage.init_db()
+    for n in range(CHATS):
+        storage.add_custom_command(-1000 - n, 'hello', 'Hi there!')
+        storage.set_link_rule(-1000 - n, 'example.com', True)
+    storage.close_db()
+
+    updates = make_updates(count)
+    print(f"{count:,} updates over {CHATS} chats, {os.cpu_count()} cores")
+    base = None
+    shards = 1
+    while shards <= max_shards:
+        elapsed = run(shards, updates)
+        rate = count / elapsed
+        base = base or rate
+        print(f"  {shards:>2} shards  {rate:>10,.0f} updates/sec  speedup {rate / base:4.2f}x")
+        shards *= 2
+
+
+if __name__ == '__main__':
+    main()
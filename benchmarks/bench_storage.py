@@ -0,0 +1,112 @@
+"""Compare the old connect-per-call helpers with the pooled storage layer.
+
+Usage: python benchmarks/bench_storage.py [iterations]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import storage  # noqa: E402
+
+
+# Legacy helpers, as they were in bot.py before the storage module existed
+def legacy_get_user_warnings(path, chat_id, user_id):
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute('SELECT warnings FROM warnings WHERE chat_id = ? AND user_id = ?', (chat_id, user_id))
+    result = cursor.fetchone()
+    conn.close()
+    return result[0] if result else 0
+
+
+def legacy_update_user_warnings(path, chat_id, user_id, warnings):
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT OR REPLACE INTO warnings (chat_id, user_id, warnings, last_warned)
+        VALUES (?, ?, ?, ?)
+    ''', (chat_id, user_id, warnings, datetime.now()))
+    conn.commit()
+    conn.close()
+
+
+def legacy_get_custom_command(path, chat_id, command):
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute('SELECT response FROM custom_commands WHERE chat_id = ? AND command = ?',
+                   (chat_id, command.lower()))
+    result = cursor.fetchone()
+    conn.close()
+    return result[0] if result else None
+
+
+def legacy_match_custom_command(path, chat_id, message_text):
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute('SELECT command, response FROM custom_commands WHERE chat_id = ?', (chat_id,))
+    results = cursor.fetchall()
+    conn.close()
+    for command, response in results:
+        if message_text.lower() == command.lower():
+            return response
+    return None
+
+
+def run(label, fn, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    elapsed = time.perf_counter() - start
+    ops = iterations / elapsed
+    print(f"{label:<48} {ops:>12,.0f} ops/sec")
+    return ops
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, 'legacy.db')
+        storage.DB_PATH = legacy_path
+        storage.init_db()
+        for n in range(50):
+            storage.add_custom_command(-100, f'cmd{n}', f'response {n}')
+        storage.add_custom_command(-100, 'hi', 'hello')
+        storage.close_db()
+
+        storage.DB_PATH = os.path.join(tmp, 'pooled.db')
+        storage.init_db()
+        for n in range(50):
+            storage.add_custom_command(-100, f'cmd{n}', f'response {n}')
+        storage.add_custom_command(-100, 'hi', 'hello')
+
+        results = [
+            ('get_user_warnings',
+             lambda i: legacy_get_user_warnings(legacy_path, -100, i % 50),
+             lambda i: storage.get_user_warnings(-100, i % 50)),
+            ('get_custom_command',
+             lambda i: legacy_get_custom_command(legacy_path, -100, 'hi'),
+             lambda i: storage.get_custom_command(-100, 'hi')),
+            ('match plain-text trigger',
+             lambda i: legacy_match_custom_command(legacy_path, -100, 'Hi'),
+             lambda i: storage.load_command_index(-100).get(storage.normalize_trigger('Hi'))),
+            ('update_user_warnings',
+             lambda i: legacy_update_user_warnings(legacy_path, -100, i % 50, i),
+             lambda i: storage.update_user_warnings(-100, i % 50, i)),
+        ]
+
+        for name, legacy, pooled in results:
+            before = run(f"{name} (connect per call)", legacy, iterations)
+            after = run(f"{name} (storage)", pooled, iterations)
+            print(f"{'':<48} {after / before:>11.1f}x\n")
+
+        storage.close_db()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""Local latency comparison of polling vs webhook delivery.
+
+Starts a stand-in Bot API server (getMe, getUpdates, setWebhook,
+deleteWebhook, sendMessage) and a small Application pointed at it via
+base_url. Each round injects one message update and measures the time until
+the bot's reply reaches the stand-in, first with long polling and then with
+the webhook server that run_webhook uses (secret token and allowed_updates
+included).
+
+Usage: python benchmarks/bench_webhook.py [rounds] [simulated rtt ms]
+"""
+import asyncio
+import json
+import secrets
+import socket
+import statistics
+import sys
+import time
+
+import tornado.httpclient
+import tornado.httpserver
+import tornado.netutil
+import tornado.web
+from telegram import Update
+from telegram.ext import Application, MessageHandler, filters
+
+BOT_ID = 123456
+TOKEN = f"{BOT_ID}:bench"
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CHAT_MEMBER, Update.MY_CHAT_MEMBER]
+
+
+class StandInBotAPI:
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.updates = asyncio.Queue()
+        self.webhook_url = None
+        self.secret_token = None
+        self.allowed_updates = None
+        self.reply = None
+        self.message_id = 0
+        self.closed = False
+
+    async def delay(self):
+        if self.rtt:
+            await asyncio.sleep(self.rtt / 2)
+
+    def result(self, method, params):
+        if method == 'getMe':
+            return {'id': BOT_ID, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        if method == 'setWebhook':
+            self.webhook_url = params['url']
+            self.secret_token = params.get('secret_token')
+            self.allowed_updates = params.get('allowed_updates')
+            return True
+        if method == 'deleteWebhook':
+            self.webhook_url = None
+            return True
+        if method == 'sendMessage':
+            self.message_id += 1
+            if self.reply and not self.reply.done():
+                self.reply.set_result(time.perf_counter())
+            return {
+                'message_id': self.message_id,
+                'date': int(time.time()),
+                'chat': {'id': int(params['chat_id']), 'type': 'group', 'title': 'bench'},
+                'text': params['text'],
+            }
+        return True
+
+    async def get_updates(self, params):
+        self.allowed_updates = params.get('allowed_updates')
+        if self.closed:
+            return []
+        try:
+            update = await asyncio.wait_for(self.updates.get(), timeout=float(params.get('timeout', 0)) or 0.01)
+        except asyncio.TimeoutError:
+            return []
+        return [update] if update else []
+
+    def close(self):
+        # Release a pending long poll so the updater can stop cleanly
+        self.closed = True
+        self.updates.put_nowait(None)
+
+    def make_app(self):
+        api = self
+
+        class MethodHandler(tornado.web.RequestHandler):
+            async def post(self, token, method):
+                params = {}
+                for key, values in self.request.body_arguments.items():
+                    value = values[0].decode()
+                    params[key] = json.loads(value) if value[:1] in '[{' else value
+                if method == 'getUpdates':
+                    result = await api.get_updates(params)
+                else:
+                    result = api.result(method, params)
+                await api.delay()
+                self.write({'ok': True, 'result': result})
+
+        return tornado.web.Application([(r'/bot([^/]+)/(\w+)', MethodHandler)])
+
+    async def push(self, update):
+        await self.delay()
+        if self.webhook_url:
+            client = tornado.httpclient.AsyncHTTPClient()
+            await client.fetch(
+                self.webhook_url,
+                method='POST',
+                body=json.dumps(update),
+                headers={
+                    'Content-Type': 'application/json',
+                    'X-Telegram-Bot-Api-Secret-Token': self.secret_token,
+                },
+            )
+        else:
+            await self.updates.put(update)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def message_update(update_id):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': -100, 'type': 'group', 'title': 'bench'},
+            'from': {'id': 42, 'is_bot': False, 'first_name': 'User'},
+            'text': 'ping',
+        },
+    }
+
+
+async def reply(update, context):
+    await context.bot.send_message(update.effective_chat.id, 'pong')
+
+
+async def measure(mode, rounds, rtt):
+    api = StandInBotAPI(rtt)
+    sockets = tornado.netutil.bind_sockets(0, '127.0.0.1')
+    server = tornado.httpserver.HTTPServer(api.make_app())
+    server.add_sockets(sockets)
+    api_port = sockets[0].getsockname()[1]
+
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .base_url(f'http://127.0.0.1:{api_port}/bot')
+        # Room for the final getUpdates call made while the last poll is cancelled
+        .get_updates_connection_pool_size(2)
+        .build()
+    )
+    application.add_handler(MessageHandler(filters.TEXT, reply))
+    await application.initialize()
+    await application.start()
+
+    if mode == 'webhook':
+        port = free_port()
+        await application.updater.start_webhook(
+            listen='127.0.0.1',
+            port=port,
+            url_path='telegram',
+            webhook_url=f'http://127.0.0.1:{port}/telegram',
+            secret_token=secrets.token_urlsafe(32),
+            allowed_updates=ALLOWED_UPDATES,
+        )
+    else:
+        await application.updater.start_polling(timeout=10, allowed_updates=ALLOWED_UPDATES)
+        await asyncio.sleep(0.1)
+
+    note = ''
+    if mode == 'webhook':
+        # Requests without the secret token must be rejected
+        client = tornado.httpclient.AsyncHTTPClient()
+        response = await client.fetch(api.webhook_url, method='POST', raise_error=False,
+                                      body=json.dumps(message_update(0)),
+                                      headers={'Content-Type': 'application/json'})
+        note = f"  unsigned request -> HTTP {response.code}"
+
+    latencies = []
+    loop = asyncio.get_running_loop()
+    for update_id in range(1, rounds + 1):
+        api.reply = loop.create_future()
+        start = time.perf_counter()
+        await api.push(message_update(update_id))
+        latencies.append(await asyncio.wait_for(api.reply, timeout=30) - start)
+
+    api.close()
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    server.stop()
+
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000
+    print(f"{mode:<8} p50 {p50:7.2f} ms  p99 {p99:7.2f} ms  "
+          f"allowed_updates={api.allowed_updates}{note}")
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rtt = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0
+    print(f"{rounds} updates, simulated rtt {rtt * 1000:.0f} ms")
+    for mode in ('polling', 'webhook'):
+        asyncio.run(measure(mode, rounds, rtt))
+
+
+if __name__ == '__main__':
+    main()
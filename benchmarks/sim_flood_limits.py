@@ -0,0 +1,131 @@
+"""Flood-limit simulation for the outbound scheduler.
+
+Drives an ExtBot whose HTTP layer is a fake Bot API: it enforces the
+global and per-group limits (scaled down so the run is short), answers
+violations with 429 RetryAfter, and injects extra 429s at random. A burst
+of chatter is queued first and a batch of moderation calls right after;
+the run checks that every call succeeds, that moderation overtakes the
+queued chatter, and that no group goes over its limit.
+
+Usage: python benchmarks/sim_flood_limits.py
+Exits non-zero if any check fails.
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict, deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from telegram.ext import ExtBot  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+from outbound import OutboundScheduler, counts_as_message  # noqa: E402
+
+# Scaled limits: 20 requests/sec overall, 5 messages per 2 seconds per group
+OVERALL_RATE = 20
+GROUP_RATE = 5
+GROUP_PERIOD = 2
+INJECTED_429 = 0.05
+
+
+class FakeBotAPI(BaseRequest):
+    def __init__(self):
+        self.recent = deque()
+        self.recent_by_group = defaultdict(deque)
+        self.completed = []  # (time, endpoint, chat_id)
+        self.rejected = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return 5
+
+    def _too_many(self, window, period, limit, now):
+        while window and window[0] <= now - period:
+            window.popleft()
+        return len(window) >= limit
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        endpoint = url.rsplit('/', 1)[1]
+        params = request_data.parameters if request_data else {}
+        chat_id = int(params.get('chat_id', 0))
+        now = time.monotonic()
+        group = self.recent_by_group[chat_id] if chat_id < 0 and counts_as_message(endpoint) else None
+
+        if (self._too_many(self.recent, 1, OVERALL_RATE, now)
+                or (group is not None and self._too_many(group, GROUP_PERIOD, GROUP_RATE, now))
+                or random.random() < INJECTED_429):
+            self.rejected += 1
+            return 429, json.dumps({
+                'ok': False, 'error_code': 429,
+                'description': 'Too Many Requests: retry after 1',
+                'parameters': {'retry_after': 1},
+            }).encode()
+
+        self.recent.append(now)
+        if group is not None:
+            group.append(now)
+        self.completed.append((now, endpoint, chat_id))
+        if endpoint == 'sendMessage':
+            result = {'message_id': len(self.completed), 'date': int(time.time()),
+                      'chat': {'id': chat_id, 'type': 'supergroup'}, 'text': params['text']}
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+async def simulate():
+    api = FakeBotAPI()
+    scheduler = OutboundScheduler(overall_rate=OVERALL_RATE, group_rate=GROUP_RATE,
+                                  group_period=GROUP_PERIOD, group_burst=2, max_retries=10)
+    bot = ExtBot('1:fake', request=api, get_updates_request=FakeBotAPI(), rate_limiter=scheduler)
+    await scheduler.initialize()
+
+    groups = [-1001, -1002, -1003]
+    start = time.monotonic()
+    chatter = [asyncio.create_task(bot.send_message(groups[i % 3], f'chatter {i}')) for i in range(30)]
+    await asyncio.sleep(0)
+    moderation = [asyncio.create_task(bot.ban_chat_member(groups[i % 3], 1000 + i)) for i in range(10)]
+
+    results = await asyncio.gather(*chatter, *moderation, return_exceptions=True)
+    elapsed = time.monotonic() - start
+    await scheduler.shutdown()
+
+    failures = [r for r in results if isinstance(r, Exception)]
+    bans = [t for t, endpoint, _ in api.completed if endpoint == 'banChatMember']
+    sends = [t for t, endpoint, _ in api.completed if endpoint == 'sendMessage']
+
+    over_limit = False
+    for chat_id in groups:
+        times = [t for t, endpoint, c in api.completed if c == chat_id and endpoint == 'sendMessage']
+        for i in range(len(times) - GROUP_RATE):
+            if times[i + GROUP_RATE] - times[i] < GROUP_PERIOD * 0.95:
+                over_limit = True
+
+    checks = [
+        ("every call succeeded", not failures),
+        ("moderation finished before most chatter", max(bans) <= sorted(sends)[len(sends) // 2]),
+        ("no group over its message limit", not over_limit),
+    ]
+    print(f"{len(results)} calls in {elapsed:.1f}s, {api.rejected} answered with 429")
+    for label, ok in checks:
+        print(f"  {label:<42} {'ok' if ok else 'FAILED'}")
+    return all(ok for _, ok in checks)
+
+
+def main():
+    random.seed(7)
+    sys.exit(0 if asyncio.run(simulate()) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Concurrency stress check for the atomic warning counters.
+
+Fires thousands of parallel warns at one user, both through run_db (as the
+handlers do) and from several threads with their own connections (as
+separate processes would), then checks that no increment was lost. The old
+read-then-write helpers are run the same way for comparison.
+
+Usage: python benchmarks/stress_warnings.py [warns] [threads]
+Exits non-zero if the atomic counters lose an update.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import storage  # noqa: E402
+
+CHAT_ID = -100
+USER_ID = 42
+
+
+def legacy_warn():
+    current = storage.get_user_warnings(CHAT_ID, USER_ID)
+    storage.update_user_warnings(CHAT_ID, USER_ID, current + 1)
+
+
+def atomic_warn():
+    storage.increment_warnings(CHAT_ID, USER_ID)
+
+
+def run_threads(warn, warns, threads):
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for future in [pool.submit(warn) for _ in range(warns)]:
+            future.result()
+
+
+async def run_async(warns):
+    await asyncio.gather(*[storage.run_db(storage.increment_warnings, CHAT_ID, USER_ID)
+                           for _ in range(warns)])
+
+
+def check(label, expected):
+    actual = storage.get_user_warnings(CHAT_ID, USER_ID)
+    status = 'ok' if actual == expected else f'LOST {expected - actual}'
+    print(f"{label:<36} expected {expected:>6}  got {actual:>6}  {status}")
+    storage.reset_warnings(CHAT_ID, USER_ID)
+    return actual == expected
+
+
+def main():
+    warns = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    ok = True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.DB_PATH = os.path.join(tmp, 'stress.db')
+        storage.init_db()
+
+        start = time.perf_counter()
+        run_threads(legacy_warn, warns, threads)
+        check(f"read-modify-write, {threads} threads", warns)
+
+        run_threads(atomic_warn, warns, threads)
+        ok &= check(f"atomic upsert, {threads} threads", warns)
+
+        asyncio.run(run_async(warns))
+        storage.close_db()
+        ok &= check("atomic upsert, run_db", warns)
+
+        for _ in range(3):
+            storage.increment_warnings(CHAT_ID, USER_ID)
+        results = [storage.decrement_warnings(CHAT_ID, USER_ID) for _ in range(5)]
+        floor_ok = results == [2, 1, 0, None, None] and storage.get_user_warnings(CHAT_ID, USER_ID) == 0
+        print(f"{'decrement floors at 0':<36} {results}  {'ok' if floor_ok else 'FAILED'}")
+        ok &= floor_ok
+
+        print(f"\ntotal {time.perf_counter() - start:.2f}s")
+        storage.close_db()
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,32 +1,96 @@
 import os
+import asyncio
 import logging
-import sqlite3
-import re
+import secrets
+import html
+import time
 from datetime import datetime
 from telegram import (
     Update, 
+    Chat,
     InlineKeyboardButton, 
     InlineKeyboardMarkup,
-    BotCommand
+    BotCommand,
+    ChatPermissions,
+    MessageEntity
 )
 from telegram.ext import (
     Application, 
     CommandHandler, 
     MessageHandler, 
     CallbackQueryHandler, 
+    ChatMemberHandler,
+    TypeHandler,
     ContextTypes, 
     filters
 )
+from storage import (
+    settings_cache_stats,
+    init_db,
+    close_db,
+    flush_writes,
+    run_db,
+    get_user_warnings,
+    increment_warnings,
+    decrement_warnings,
+    reset_warnings,
+    reset_all_warnings,
+    parse_duration,
+    get_warn_expiry_chats,
+    delete_expired_warnings,
+    WARN_SWEEP_BATCH,
+    get_chat_settings,
+    get_cached_chat_settings,
+    set_chat_settings,
+    add_custom_command,
+    get_custom_command,
+    get_custom_commands_page,
+    delete_custom_command,
+    get_command_index,
+    load_command_index,
+    normalize_trigger,
+    ban_user,
+    unban_user,
+    ban_users,
+    unban_users,
+    get_banned_page,
+    record_joins,
+    get_recent_joins,
+    delete_old_joins,
+    delete_old_mod_actions,
+    users_to_save,
+    save_users,
+    get_cached_user_id,
+    find_user_id,
+    user_directory_stats,
+    get_cached_link_rules,
+    load_link_rules,
+    set_link_rule,
+    delete_link_rule
+)
+from links import find_links, host_of, is_link_allowed
+from admins import AdminCache, ADMIN_STATUSES
+from processing import ChatOrderedUpdateProcessor
+from outbound import OutboundScheduler
+from welcome import WelcomeBatcher
+from floods import FloodDetector
+import metrics
+import profiling
+from logs import setup_logging
+from sharding import ShardedReceiver
+from pipeline import MessagePipeline
+from moderation import ModerationQueue
 
-# Enable logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()
-    ]
+# Enable logging (queued, rotating; LOG_FORMAT=json for structured output)
+setup_logging(
+    path=os.environ.get('LOG_FILE', 'bot.log'),
+    level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+    max_bytes=int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+    backups=int(os.environ.get('LOG_BACKUPS', 3)),
+    json_output=os.environ.get('LOG_FORMAT', '').lower() == 'json'
 )
+# One access line per metrics scrape is noise
+logging.getLogger('tornado.access').setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 # ✅ IMPORTANT: Render.com এর জন্য Environment Variable থেকে টোকেন নিবে
@@ -38,57 +102,39 @@ if not BOT_TOKEN:
     logger.error("💡 Please set BOT_TOKEN in Render.com dashboard")
     exit(1)
 
-# Database setup
-def init_db():
-    conn = sqlite3.connect('bot_data.db')
-    cursor = conn.cursor()
-    
-    # Warnings table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS warnings (
-            chat_id INTEGER,
-            user_id INTEGER,
-            warnings INTEGER DEFAULT 0,
-            last_warned TIMESTAMP,
-            PRIMARY KEY (chat_id, user_id)
-        )
-    ''')
-    
-    # Chat settings table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS chat_settings (
-            chat_id INTEGER PRIMARY KEY,
-            warn_mode TEXT DEFAULT 'mute',
-            warn_limit INTEGER DEFAULT 3,
-            warn_time TEXT DEFAULT 'off',
-            welcome_msg TEXT,
-            rules_msg TEXT
-        )
-    ''')
-    
-    # Custom commands table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS custom_commands (
-            chat_id INTEGER,
-            command TEXT,
-            response TEXT,
-            PRIMARY KEY (chat_id, command)
-        )
-    ''')
-    
-    # Banned users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS banned_users (
-            chat_id INTEGER,
-            user_id INTEGER,
-            banned_by INTEGER,
-            ban_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            PRIMARY KEY (chat_id, user_id)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+# Update types the handlers below actually use. chat_member updates are only
+# delivered when requested explicitly.
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY, Update.CHAT_MEMBER, Update.MY_CHAT_MEMBER]
+
+# Webhook mode: used when BOT_MODE is 'webhook', or by default when a public
+# URL is known (Render.com sets RENDER_EXTERNAL_URL). Falls back to polling.
+BOT_MODE = os.environ.get('BOT_MODE', '').lower()
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', 'telegram')
+# Telegram sends this in X-Telegram-Bot-Api-Secret-Token and requests without it
+# are rejected. A random secret is registered with setWebhook on every start.
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+
+def get_webhook_url():
+    if BOT_MODE == 'polling':
+        return None
+    base_url = os.environ.get('WEBHOOK_URL') or os.environ.get('RENDER_EXTERNAL_URL')
+    if not base_url:
+        if BOT_MODE == 'webhook':
+            logger.error("BOT_MODE=webhook but WEBHOOK_URL is not set, falling back to polling")
+        return None
+    return f"{base_url.rstrip('/')}/{WEBHOOK_PATH}"
+
+# Metrics (/metrics) are served on PORT in polling mode. In webhook mode PORT
+# belongs to the webhook server, so they need METRICS_PORT.
+def get_metrics_port():
+    if os.environ.get('METRICS_PORT'):
+        return int(os.environ['METRICS_PORT'])
+    if get_webhook_url():
+        return None
+    return int(os.environ.get('PORT', 8443))
+
+# Admin rosters are cached per chat and refreshed with getChatAdministrators
+admin_cache = AdminCache(ttl=int(os.environ.get('ADMIN_CACHE_TTL', 300)))
 
 # Helper function to check admin
 async def is_admin(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int = None):
@@ -97,137 +143,25 @@ async def is_admin(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id:
         user_id = update.effective_user.id
     
     try:
-        chat_member = await context.bot.get_chat_member(chat_id, user_id)
-        return chat_member.status in ['administrator', 'creator']
+        return await admin_cache.is_admin(context.bot, chat_id, user_id)
     except:
         return False
 
-# Database functions
-def get_user_warnings(chat_id, user_id):
-    conn = sqlite3.connect('bot_data.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT warnings FROM warnings WHERE chat_id = ? AND user_id = ?', (chat_id, user_id))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else 0
-
-def update_user_warnings(chat_id, user_id, warnings):
-    conn = sqlite3.connect('bot_data.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT OR REPLACE INTO warnings (chat_id, user_id, warnings, last_warned)
-        VALUES (?, ?, ?, ?)
-    ''', (chat_id, user_id, warnings, datetime.now()))
-    conn.commit()
-    conn.close()
-
-def get_chat_settings(chat_id):
-    conn = sqlite3.connect('bot_data.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM chat_settings WHERE chat_id = ?', (chat_id,))
-    result = cursor.fetchone()
-    conn.close()
-    
-    if result:
-        return {
-            'warn_mode': result[1],
-            'warn_limit': result[2],
-            'warn_time': result[3],
-            'welcome_msg': result[4],
-            'rules_msg': result[5]
-        }
-    else:
-        # Default settings
-        default_settings = {
-            'warn_mode': 'mute',
-            'warn_limit': 3,
-            'warn_time': 'off',
-            'welcome_msg': None,
-            'rules_msg': None
-        }
-        set_chat_settings(chat_id, default_settings)
-        return default_settings
-
-def set_chat_settings(chat_id, settings):
-    conn = sqlite3.connect('bot_data.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT OR REPLACE INTO chat_settings 
-        (chat_id, warn_mode, warn_limit, warn_time, welcome_msg, rules_msg)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (chat_id, settings['warn_mode'], settings['warn_limit'], 
-          settings['warn_time'], settings['welcome_msg'], settings['rules_msg']))
-    conn.commit()
-    conn.close()
-
-def add_custom_command(chat_id, command, response):
-    conn = sqlite3.connect('bot_data.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT OR REPLACE INTO custom_commands (chat_id, command, response)
-        VALUES (?, ?, ?)
-    ''', (chat_id, command.lower(), response))
-    conn.commit()
-    conn.close()
-
-def get_custom_command(chat_id, command):
-    conn = sqlite3.connect('bot_data.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT response FROM custom_commands WHERE chat_id = ? AND command = ?', 
-                   (chat_id, command.lower()))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else None
-
-def get_all_custom_commands(chat_id):
-    conn = sqlite3.connect('bot_data.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT command, response FROM custom_commands WHERE chat_id = ?', (chat_id,))
-    results = cursor.fetchall()
-    conn.close()
-    return results
-
-def delete_custom_command(chat_id, command):
-    conn = sqlite3.connect('bot_data.db')
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM custom_commands WHERE chat_id = ? AND command = ?', 
-                   (chat_id, command.lower()))
-    conn.commit()
-    conn.close()
-
-def ban_user(chat_id, user_id, banned_by):
-    conn = sqlite3.connect('bot_data.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT OR REPLACE INTO banned_users (chat_id, user_id, banned_by, ban_time)
-        VALUES (?, ?, ?, ?)
-    ''', (chat_id, user_id, banned_by, datetime.now()))
-    conn.commit()
-    conn.close()
-
-def unban_user(chat_id, user_id):
-    conn = sqlite3.connect('bot_data.db')
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM banned_users WHERE chat_id = ? AND user_id = ?', (chat_id, user_id))
-    conn.commit()
-    conn.close()
-    return cursor.rowcount > 0
-
-def is_user_banned(chat_id, user_id):
-    conn = sqlite3.connect('bot_data.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT 1 FROM banned_users WHERE chat_id = ? AND user_id = ?', (chat_id, user_id))
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None
-
-def get_banned_users(chat_id):
-    conn = sqlite3.connect('bot_data.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT user_id, banned_by, ban_time FROM banned_users WHERE chat_id = ?', (chat_id,))
-    results = cursor.fetchall()
-    conn.close()
-    return results
+# Drop the cached admin roster as soon as someone is promoted or demoted
+async def chat_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    member_update = update.chat_member or update.my_chat_member
+    old_status = member_update.old_chat_member.status
+    new_status = member_update.new_chat_member.status
+    
+    if (old_status in ADMIN_STATUSES) != (new_status in ADMIN_STATUSES):
+        admin_cache.invalidate(member_update.chat.id)
+
+# Chat settings, served from the in-memory cache when possible
+async def load_chat_settings(chat_id):
+    settings = get_cached_chat_settings(chat_id)
+    if settings is None:
+        settings = await run_db(get_chat_settings, chat_id)
+    return settings
 
 # Start command
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -262,12 +196,16 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 - /warnings: Get the chat's warning settings.
 - /warnmode <ban/mute/kick>: View or set the chat's warn mode.
 - /warnlimit <number>: View or set the warning limit.
-- /warntime <time>: View or set warn expiration time.
+- /warntime <time>: View or set warn expiration time (e.g. 30m, 6h, 3d, 1w or off).
 
 *Ban Management:*
 - /ban @user: Ban a user from the chat.
 - /banlist: Show list of banned users.
 - /unban @user: Unban a user from the chat.
+- /bulkban <id> <id> ...: Ban many users at once
+- /bulkunban <id> <id> ...: Unban many users at once
+- /banrecent <minutes>: Ban everyone who joined in the last N minutes
+- /purge: Reply to a message to delete everything from it up to now
 
 *Chat Settings:*
 - /welcome <message>: Set welcome message
@@ -276,6 +214,10 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
   Example: /cmd hi
 - /delcmd <trigger>: Delete custom command
 - /cmds: List all custom commands
+- /linkallow <domain>: Allow links to a domain
+- /linkdeny <domain>: Always remove links to a domain
+- /linkremove <domain>: Remove a link rule
+- /linkrules: Show link rules
 
 *User Commands:*
 - /rules: View chat rules
@@ -306,7 +248,7 @@ async def set_custom_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
     
     # Check if command already exists
-    existing = get_custom_command(chat_id, trigger)
+    existing = await run_db(get_custom_command, chat_id, trigger)
     if existing:
         await update.message.reply_text(
             f"⚠️ Command `{trigger}` already exists!\n"
@@ -332,14 +274,14 @@ async def set_custom_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     context.user_data['response_parts'] = []
 
 # Helper function to save custom command
-def save_custom_command_from_context(chat_id, context):
+async def save_custom_command_from_context(chat_id, context):
     trigger = context.user_data.get('cmd_trigger')
     response_parts = context.user_data.get('response_parts', [])
     
     if trigger and response_parts:
         # Combine all response parts
         response = "\n".join(response_parts)
-        add_custom_command(chat_id, trigger, response)
+        await run_db(add_custom_command, chat_id, trigger, response)
         
         # Clear context
         context.user_data.pop('cmd_trigger', None)
@@ -359,7 +301,7 @@ async def handle_cmd_response(update: Update, context: ContextTypes.DEFAULT_TYPE
         
         # Check if user wants to finish
         if message_text.strip().lower() == '!done':
-            trigger, response = save_custom_command_from_context(chat_id, context)
+            trigger, response = await save_custom_command_from_context(chat_id, context)
             
             if trigger and response:
                 await update.message.reply_text(
@@ -396,6 +338,17 @@ async def handle_cmd_response(update: Update, context: ContextTypes.DEFAULT_TYPE
             f"Send more or reply with *!done* to save."
         )
 
+# While an admin is composing a /cmd response, their messages are parts of it
+async def capture_cmd_response(message_context):
+    user_data = message_context.context.user_data
+    if not user_data or not user_data.get('waiting_for_response'):
+        return False
+    if filters.COMMAND.check_update(message_context.update):
+        return False
+    
+    await handle_cmd_response(message_context.update, message_context.context)
+    return True
+
 # Delete custom command
 async def delete_custom_command_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
@@ -412,27 +365,40 @@ async def delete_custom_command_cmd(update: Update, context: ContextTypes.DEFAUL
     if trigger.startswith('/'):
         trigger = trigger[1:]
     
-    if get_custom_command(chat_id, trigger):
-        delete_custom_command(chat_id, trigger)
+    if await run_db(get_custom_command, chat_id, trigger):
+        await run_db(delete_custom_command, chat_id, trigger)
         await update.message.reply_text(f"✅ Command `{trigger}` deleted successfully!")
     else:
         await update.message.reply_text(f"❌ Command `{trigger}` not found!")
 
 # List custom commands
 async def list_custom_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await send_commands_page(update, context)
+
+async def send_commands_page(update: Update, context: ContextTypes.DEFAULT_TYPE, cursor: int = 0, previous: bool = False):
     chat_id = update.effective_chat.id
     
-    commands = get_all_custom_commands(chat_id)
+    commands, more = await run_db(get_custom_commands_page, chat_id, cursor, previous, PAGE_SIZE)
+    if not commands and cursor:
+        # The page is gone (commands deleted meanwhile); start over
+        commands, more = await run_db(get_custom_commands_page, chat_id, 0, False, PAGE_SIZE)
+        cursor, previous = 0, False
     if not commands:
-        await update.message.reply_text("No custom commands set for this chat.")
+        await send_page(update, "No custom commands set for this chat.")
         return
     
     commands_text = "📋 *Custom Commands:*\n\n"
-    for i, (cmd, response) in enumerate(commands, 1):
+    for rowid, cmd, response in commands:
         response_preview = response[:50] + "..." if len(response) > 50 else response
-        commands_text += f"{i}. `{cmd}`\n   ➤ {response_preview}\n\n"
+        commands_text += f"• `{cmd}`\n   ➤ {response_preview}\n\n"
     
-    await update.message.reply_text(commands_text, parse_mode='Markdown')
+    has_previous = more if previous else cursor > 0
+    has_next = True if previous else more
+    keyboard = page_keyboard(
+        f"cm:p:{commands[0][0]}" if has_previous else None,
+        f"cm:n:{commands[-1][0]}" if has_next else None
+    )
+    await send_page(update, commands_text, keyboard)
 
 # Welcome command
 async def set_welcome(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -444,13 +410,13 @@ async def set_welcome(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     if not context.args:
-        await update.message.reply_text("Usage: /welcome <message>\n\nYou can use:\n{mention} - User mention\n{title} - Chat title")
+        await update.message.reply_text("Usage: /welcome <message>\n\nYou can use:\n{mention} - User mention(s)\n{title} - Chat title")
         return
     
     welcome_msg = ' '.join(context.args)
-    settings = get_chat_settings(chat_id)
+    settings = await load_chat_settings(chat_id)
     settings['welcome_msg'] = welcome_msg
-    set_chat_settings(chat_id, settings)
+    await run_db(set_chat_settings, chat_id, settings)
     
     await update.message.reply_text("✅ Welcome message set successfully!")
 
@@ -468,22 +434,46 @@ async def set_rules(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     rules_msg = ' '.join(context.args)
-    settings = get_chat_settings(chat_id)
+    settings = await load_chat_settings(chat_id)
     settings['rules_msg'] = rules_msg
-    set_chat_settings(chat_id, settings)
+    await run_db(set_chat_settings, chat_id, settings)
     
     await update.message.reply_text("✅ Rules set successfully!")
 
 # Rules command (user)
 async def show_rules(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    settings = get_chat_settings(chat_id)
+    settings = await load_chat_settings(chat_id)
     
     if settings['rules_msg']:
         await update.message.reply_text(f"📜 *Chat Rules:*\n\n{settings['rules_msg']}", parse_mode='Markdown')
     else:
         await update.message.reply_text("No rules have been set for this chat yet.")
 
+# Target of /ban and /unban: a text mention (users without a username), an
+# @username from the user directory, or a numeric ID. Returns (user_id, name,
+# remaining args), user_id None for an unknown @username, or None if there is
+# no target at all.
+async def resolve_target(message, args):
+    for entity in message.entities:
+        if entity.type == MessageEntity.TEXT_MENTION:
+            # Entity offsets count UTF-16 code units
+            text = message.text.encode('utf-16-le')
+            rest = text[(entity.offset + entity.length) * 2:].decode('utf-16-le')
+            return entity.user.id, entity.user.first_name, rest.split()
+    
+    if not args:
+        return None
+    target = args[0]
+    if target.startswith('@') and len(target) > 1:
+        user_id = get_cached_user_id(target)
+        if user_id is None:
+            user_id = await run_db(find_user_id, target)
+        return user_id, target, args[1:]
+    if target.isdigit():
+        return int(target), f"user_{target}", args[1:]
+    return None
+
 # Ban command
 async def ban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
@@ -499,28 +489,16 @@ async def ban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.message.reply_to_message.from_user.id
         username = update.message.reply_to_message.from_user.username or update.message.reply_to_message.from_user.first_name
         reason = ' '.join(context.args) if context.args else "No reason provided"
-    elif context.args:
-        # Try to get user from mention
-        try:
-            mention = context.args[0]
-            if mention.startswith('@'):
-                # We need to extract user from mention - simplified approach
-                # In production, you'd need to parse the user_id from mention properly
-                await update.message.reply_text("Please reply to the user's message to ban them, or use user ID.")
-                return
-            elif mention.isdigit():
-                user_id = int(mention)
-                username = f"user_{user_id}"
-                reason = ' '.join(context.args[1:]) if len(context.args) > 1 else "No reason provided"
-            else:
-                await update.message.reply_text("Usage: /ban @user OR reply to user's message")
-                return
-        except (ValueError, IndexError):
+    else:
+        target = await resolve_target(update.message, context.args)
+        if target is None:
             await update.message.reply_text("Usage: /ban @user OR reply to user's message")
             return
-    else:
-        await update.message.reply_text("Usage: /ban @user OR reply to user's message")
-        return
+        user_id, username, rest = target
+        if user_id is None:
+            await update.message.reply_text(f"I haven't seen {username} yet. Reply to their message or use their user ID.")
+            return
+        reason = ' '.join(rest) if rest else "No reason provided"
     
     # Don't allow banning admins
     if await is_admin(update, context, user_id):
@@ -532,7 +510,7 @@ async def ban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.ban_chat_member(chat_id, user_id)
         
         # Store in database
-        ban_user(chat_id, user_id, admin_id)
+        await run_db(ban_user, chat_id, user_id, admin_id)
         
         ban_message = f"✅ User {username} has been banned!"
         if reason and reason != "No reason provided":
@@ -552,24 +530,13 @@ async def unban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Only admins can unban users!")
         return
     
-    if context.args:
-        try:
-            # Extract user from argument
-            user_arg = context.args[0]
-            if user_arg.startswith('@'):
-                # This is simplified - in production, parse username properly
-                await update.message.reply_text("Please use user ID to unban, or reply to their message if available.")
-                return
-            elif user_arg.isdigit():
-                user_id = int(user_arg)
-            else:
-                await update.message.reply_text("Please provide user ID to unban")
-                return
-        except (ValueError, IndexError):
-            await update.message.reply_text("Usage: /unban user_id")
-            return
-    else:
-        await update.message.reply_text("Usage: /unban user_id")
+    target = await resolve_target(update.message, context.args)
+    if target is None:
+        await update.message.reply_text("Usage: /unban @user OR /unban user_id")
+        return
+    user_id, username, _ = target
+    if user_id is None:
+        await update.message.reply_text(f"I haven't seen {username} yet. Please use their user ID.")
         return
     
     try:
@@ -577,7 +544,7 @@ async def unban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.unban_chat_member(chat_id, user_id)
         
         # Remove from database
-        if unban_user(chat_id, user_id):
+        if await run_db(unban_user, chat_id, user_id):
             await update.message.reply_text(f"✅ User {user_id} has been unbanned!")
         else:
             await update.message.reply_text("User was not found in ban list.")
@@ -585,58 +552,271 @@ async def unban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Error unbanning user: {e}")
         await update.message.reply_text("Failed to unban user.")
 
-# Banlist command
-async def banlist_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Bulk moderation: Bot API calls run as a background task with at most
+# BULK_CONCURRENCY in flight (paced by the rate limiter), progress is edited
+# into one message, and the DB is updated in one transaction at the end.
+BULK_CONCURRENCY = int(os.environ.get('BULK_CONCURRENCY', 8))
+BULK_PROGRESS_INTERVAL = 2
+BULK_MAX_USERS = 1000
+PURGE_MAX_MESSAGES = 1000
+JOIN_RETENTION = int(os.environ.get('JOIN_RETENTION', 24 * 3600))
+bulk_running = set()  # chats with a bulk operation in progress
+
+async def run_bulk(context: ContextTypes.DEFAULT_TYPE, chat_id: int, label: str, items, action):
+    progress = await context.bot.send_message(chat_id, f"⏳ {label}: 0/{len(items)}")
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+    succeeded = []
+    done = 0
+    last_edit = time.monotonic()
+    
+    async def run_one(item):
+        nonlocal done, last_edit
+        async with semaphore:
+            try:
+                await action(item)
+                succeeded.append(item)
+            except Exception as e:
+                logger.warning(f"{label} failed for {item}: {e}")
+            done += 1
+            now = time.monotonic()
+            if now - last_edit >= BULK_PROGRESS_INTERVAL and done < len(items):
+                last_edit = now
+                try:
+                    await progress.edit_text(f"⏳ {label}: {done}/{len(items)}")
+                except Exception:
+                    pass
+    
+    await asyncio.gather(*(run_one(item) for item in items))
+    return progress, succeeded
+
+def parse_user_ids(args):
+    user_ids = []
+    for arg in ' '.join(args).replace(',', ' ').split():
+        if arg.lstrip('-').isdigit():
+            user_ids.append(int(arg))
+    return list(dict.fromkeys(user_ids))
+
+def start_bulk(context: ContextTypes.DEFAULT_TYPE, chat_id: int, operation):
+    async def run():
+        try:
+            await operation
+        except Exception as e:
+            logger.error(f"Error in bulk operation: {e}")
+        finally:
+            bulk_running.discard(chat_id)
+    
+    bulk_running.add(chat_id)
+    context.application.create_task(run())
+
+async def bulk_ban_users(update: Update, context: ContextTypes.DEFAULT_TYPE, user_ids, label):
     chat_id = update.effective_chat.id
     
+    # Admins are never banned; the roster is cached, so these are local lookups
+    targets = [user_id for user_id in user_ids if not await is_admin(update, context, user_id)]
+    skipped = len(user_ids) - len(targets)
+    
+    progress, banned = await run_bulk(
+        context, chat_id, label, targets,
+        lambda user_id: context.bot.ban_chat_member(chat_id, user_id)
+    )
+    await run_db(ban_users, chat_id, banned, update.effective_user.id)
+    
+    result = f"✅ {label}: {len(banned)}/{len(targets)} users banned."
+    if skipped:
+        result += f"\nSkipped {skipped} admins."
+    await progress.edit_text(result)
+
+async def bulk_unban_users(update: Update, context: ContextTypes.DEFAULT_TYPE, user_ids):
+    chat_id = update.effective_chat.id
+    progress, unbanned = await run_bulk(
+        context, chat_id, "Unbanning", user_ids,
+        lambda user_id: context.bot.unban_chat_member(chat_id, user_id, only_if_banned=True)
+    )
+    await run_db(unban_users, chat_id, unbanned)
+    await progress.edit_text(f"✅ Unbanning: {len(unbanned)}/{len(user_ids)} users unbanned.")
+
+async def purge_messages(update: Update, context: ContextTypes.DEFAULT_TYPE, message_ids):
+    chat_id = update.effective_chat.id
+    # deleteMessages takes up to 100 ids per call
+    chunks = [message_ids[i:i + 100] for i in range(0, len(message_ids), 100)]
+    progress, deleted = await run_bulk(
+        context, chat_id, "Purging", chunks,
+        lambda chunk: context.bot.delete_messages(chat_id, chunk)
+    )
+    deleted_count = sum(len(chunk) for chunk in deleted)
+    await progress.edit_text(f"🧹 Purged up to {deleted_count} messages.")
+
+async def check_bulk_allowed(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await is_admin(update, context):
+        await update.message.reply_text("Only admins can use bulk commands!")
+        return False
+    if update.effective_chat.id in bulk_running:
+        await update.message.reply_text("A bulk operation is already running in this chat.")
+        return False
+    return True
+
+async def bulkban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await check_bulk_allowed(update, context):
+        return
+    
+    user_ids = parse_user_ids(context.args)
+    if not user_ids:
+        await update.message.reply_text("Usage: /bulkban <user_id> <user_id> ...")
+        return
+    if len(user_ids) > BULK_MAX_USERS:
+        await update.message.reply_text(f"At most {BULK_MAX_USERS} users at a time.")
+        return
+    
+    start_bulk(context, update.effective_chat.id, bulk_ban_users(update, context, user_ids, "Banning"))
+
+async def bulkunban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await check_bulk_allowed(update, context):
+        return
+    
+    user_ids = parse_user_ids(context.args)
+    if not user_ids:
+        await update.message.reply_text("Usage: /bulkunban <user_id> <user_id> ...")
+        return
+    if len(user_ids) > BULK_MAX_USERS:
+        await update.message.reply_text(f"At most {BULK_MAX_USERS} users at a time.")
+        return
+    
+    start_bulk(context, update.effective_chat.id, bulk_unban_users(update, context, user_ids))
+
+async def banrecent_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await check_bulk_allowed(update, context):
+        return
+    
+    try:
+        minutes = int(context.args[0])
+        if minutes <= 0 or minutes * 60 > JOIN_RETENTION:
+            raise ValueError
+    except (IndexError, ValueError):
+        await update.message.reply_text(f"Usage: /banrecent <minutes> (1-{JOIN_RETENTION // 60})")
+        return
+    
+    chat_id = update.effective_chat.id
+    user_ids = (await run_db(get_recent_joins, chat_id, minutes * 60))[:BULK_MAX_USERS]
+    if not user_ids:
+        await update.message.reply_text(f"Nobody joined in the last {minutes} minutes.")
+        return
+    
+    start_bulk(context, chat_id, bulk_ban_users(update, context, user_ids, f"Banning joins from the last {minutes} min"))
+
+async def purge_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await check_bulk_allowed(update, context):
+        return
+    
+    if not update.message.reply_to_message:
+        await update.message.reply_text("Reply to the first message to delete with /purge")
+        return
+    
+    first = update.message.reply_to_message.message_id
+    last = update.message.message_id
+    if last - first >= PURGE_MAX_MESSAGES:
+        await update.message.reply_text(f"At most {PURGE_MAX_MESSAGES} messages at a time.")
+        return
+    
+    start_bulk(context, update.effective_chat.id, purge_messages(update, context, list(range(first, last + 1))))
+
+# Paged lists (/banlist, /cmds): PAGE_SIZE rows per message, Prev/Next buttons
+# carry the keyset cursor in their callback data
+PAGE_SIZE = 20
+
+def page_keyboard(previous_data, next_data):
+    buttons = []
+    if previous_data:
+        buttons.append(InlineKeyboardButton("◀️ Prev", callback_data=previous_data))
+    if next_data:
+        buttons.append(InlineKeyboardButton("Next ▶️", callback_data=next_data))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+async def send_page(update: Update, text: str, keyboard=None):
+    if update.callback_query:
+        await update.callback_query.edit_message_text(text, parse_mode='Markdown', reply_markup=keyboard)
+    else:
+        await update.message.reply_text(text, parse_mode='Markdown', reply_markup=keyboard)
+
+# Banlist command
+async def banlist_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Check if user is admin
     if not await is_admin(update, context):
         await update.message.reply_text("Only admins can view ban list!")
         return
     
-    banned_users = get_banned_users(chat_id)
+    await send_banlist_page(update, context)
+
+async def send_banlist_page(update: Update, context: ContextTypes.DEFAULT_TYPE, cursor=None, newer: bool = False):
+    chat_id = update.effective_chat.id
     
+    banned_users, more = await run_db(get_banned_page, chat_id, cursor, newer, PAGE_SIZE)
+    if not banned_users and cursor:
+        # The page is gone (users unbanned meanwhile); start over
+        banned_users, more = await run_db(get_banned_page, chat_id, None, False, PAGE_SIZE)
+        cursor, newer = None, False
     if not banned_users:
-        await update.message.reply_text("No users are currently banned in this chat.")
+        await send_page(update, "No users are currently banned in this chat.")
         return
     
     ban_list_text = "📋 *Banned Users:*\n\n"
-    for i, (user_id, banned_by, ban_time) in enumerate(banned_users, 1):
-        ban_list_text += f"{i}. User ID: `{user_id}`\n   Banned by: {banned_by}\n   Time: {ban_time}\n\n"
+    for user_id, banned_by, ban_time in banned_users:
+        banned_at = time.strftime('%Y-%m-%d %H:%M', time.localtime(ban_time))
+        ban_list_text += f"• User ID: `{user_id}`\n   Banned by: {banned_by}\n   Time: {banned_at}\n\n"
+    
+    has_newer = more if newer else cursor is not None
+    has_older = True if newer else more
+    first, last = banned_users[0], banned_users[-1]
+    keyboard = page_keyboard(
+        f"bl:p:{first[0]}:{first[2]}" if has_newer else None,
+        f"bl:n:{last[0]}:{last[2]}" if has_older else None
+    )
+    await send_page(update, ban_list_text, keyboard)
+
+# Ban times are Unix seconds; buttons sent before the migration carry the old
+# datetime text, which is converted the same way the migration did
+def parse_ban_time(value):
+    if value.isdigit():
+        return int(value)
+    return int(datetime.fromisoformat(value).timestamp())
+
+async def page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    kind, direction, cursor = query.data.split(':', 2)
     
-    await update.message.reply_text(ban_list_text, parse_mode='Markdown')
+    if kind == 'bl':
+        if not await is_admin(update, context):
+            await query.answer("Only admins can view ban list!")
+            return
+        user_id, _, ban_time = cursor.partition(':')
+        await query.answer()
+        await send_banlist_page(update, context, (parse_ban_time(ban_time), int(user_id)), newer=direction == 'p')
+    elif kind == 'cm':
+        await query.answer()
+        await send_commands_page(update, context, int(cursor), previous=direction == 'p')
 
 # Handle custom commands when users type them
-async def handle_custom_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    chat_id = update.effective_chat.id
-    message_text = update.message.text.strip()
+async def reply_custom_command(message_context):
+    message_text = (message_context.message.text or '').strip()
+    if not message_text or filters.COMMAND.check_update(message_context.update):
+        return False
     
-    # Check if we're collecting response for /cmd
-    if context.user_data.get('waiting_for_response'):
-        await handle_cmd_response(update, context)
-        return
+    # Per-chat trigger index, loaded from the database on first use
+    commands = await message_context.get('commands')
     
     # Check if it's a custom command (not starting with /)
-    if message_text and not message_text.startswith('/'):
-        # Check if this matches any custom command
-        custom_commands = get_all_custom_commands(chat_id)
-        
-        for command, response in custom_commands:
-            # Check if message matches the command (case insensitive)
-            if message_text.lower() == command.lower():
-                await update.message.reply_text(response)
-                return
+    if not message_text.startswith('/'):
+        response = commands.get(normalize_trigger(message_text))
     
     # Also handle commands with slash
-    elif message_text.startswith('/'):
+    else:
         # Extract command without slash and parameters
-        cmd = message_text[1:].split()[0].lower()
-        
-        # Check if it's a custom command
-        response = get_custom_command(chat_id, cmd)
-        if response:
-            await update.message.reply_text(response)
-            return
+        cmd = message_text[1:].split()[0] if len(message_text) > 1 else ''
+        response = commands.get(normalize_trigger(cmd))
+    
+    if response:
+        await message_context.message.reply_text(response)
+        return True
+    return False
 
 # Warn system functions (unchanged from your code, but with admin check)
 async def warn_user(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, reason: str, delete_message: bool = False, silent: bool = False):
@@ -648,12 +828,9 @@ async def warn_user(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id:
         await update.message.reply_text("You need to be an admin to use this command.")
         return
     
-    current_warnings = get_user_warnings(chat_id, user_id)
-    new_warnings = current_warnings + 1
-    
-    update_user_warnings(chat_id, user_id, new_warnings)
+    new_warnings = await run_db(increment_warnings, chat_id, user_id)
     
-    settings = get_chat_settings(chat_id)
+    settings = await load_chat_settings(chat_id)
     warn_limit = settings['warn_limit']
     
     # Delete messages if required
@@ -672,45 +849,67 @@ async def warn_user(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id:
     if new_warnings >= warn_limit:
         await execute_warn_action(update, context, user_id, settings['warn_mode'])
 
-async def execute_warn_action(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, action: str):
+async def execute_warn_action(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, action: str,
+                              reason: str = None, until_date: int = None):
+    # Queued for the moderation workers; the key ties the action to this update
     chat_id = update.effective_chat.id
+    key = f"{chat_id}:{update.effective_message.message_id}:{user_id}:{action}"
     
     try:
-        if action == 'ban':
-            await context.bot.ban_chat_member(chat_id, user_id)
-            ban_user(chat_id, user_id, update.effective_user.id)
-            action_msg = "banned"
-        elif action == 'kick':
-            await context.bot.ban_chat_member(chat_id, user_id)
-            await context.bot.unban_chat_member(chat_id, user_id)
-            action_msg = "kicked"
-        elif action == 'mute':
-            # Restrict user's permissions
-            permissions = {
-                'can_send_messages': False,
-                'can_send_media_messages': False,
-                'can_send_polls': False,
-                'can_send_other_messages': False,
-                'can_add_web_page_previews': False,
-                'can_change_info': False,
-                'can_invite_users': False,
-                'can_pin_messages': False
-            }
-            await context.bot.restrict_chat_member(chat_id, user_id, permissions)
-            action_msg = "muted"
-        else:
-            action_msg = "punished"
-        
-        await context.bot.send_message(
-            chat_id,
-            f"User has reached the warning limit and has been {action_msg}."
-        )
-        
-        # Reset warnings after punishment
-        update_user_warnings(chat_id, user_id, 0)
-        
+        await moderation_queue.submit(context.bot, key, chat_id, user_id, action, reason, until_date,
+                                      update.effective_user.id)
     except Exception as e:
-        logger.error(f"Error executing warn action: {e}")
+        logger.error(f"Error queueing warn action: {e}")
+
+# Carried out by the moderation workers; errors are retried by the queue
+async def perform_warn_action(bot, chat_id: int, user_id: int, action: str, reason: str, until_date: int,
+                              issued_by: int):
+    if action == 'ban':
+        await bot.ban_chat_member(chat_id, user_id)
+        await run_db(ban_user, chat_id, user_id, issued_by)
+        action_msg = "banned"
+    elif action == 'kick':
+        await bot.ban_chat_member(chat_id, user_id)
+        await bot.unban_chat_member(chat_id, user_id)
+        action_msg = "kicked"
+    elif action == 'mute':
+        # Telegram treats an until_date less than 30 seconds away as forever,
+        # so a temporary mute that is already over is dropped
+        if until_date and until_date < time.time() + 30:
+            return
+        # Restrict user's permissions
+        await bot.restrict_chat_member(
+            chat_id, user_id, ChatPermissions.no_permissions(), until_date=until_date
+        )
+        action_msg = "muted"
+    else:
+        action_msg = "punished"
+    
+    if reason:
+        await bot.send_message(chat_id, f"User {reason} and has been {action_msg}.")
+        return
+    
+    await bot.send_message(
+        chat_id,
+        f"User has reached the warning limit and has been {action_msg}."
+    )
+    
+    # Reset warnings after punishment
+    await run_db(reset_warnings, chat_id, user_id)
+
+async def report_failed_action(bot, chat_id: int, user_id: int, action: str, error):
+    await bot.send_message(chat_id, f"Failed to {action} user {user_id}. Make sure I have admin permissions.")
+
+moderation_queue = ModerationQueue(
+    perform_warn_action,
+    on_failure=report_failed_action,
+    workers=int(os.environ.get('MOD_ACTION_WORKERS', 4)),
+    max_attempts=int(os.environ.get('MOD_ACTION_ATTEMPTS', 6))
+)
+
+# Moderation actions are kept this long after they finish; redelivered
+# updates within that time are recognized by their idempotency key
+MOD_ACTION_RETENTION = int(os.environ.get('MOD_ACTION_RETENTION', 7 * 86400))
 
 # Warning commands (keeping your existing functions)
 async def warn(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -756,7 +955,7 @@ async def warns(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         username = update.effective_user.username or update.effective_user.first_name
     
-    warning_count = get_user_warnings(chat_id, user_id)
+    warning_count = await run_db(get_user_warnings, chat_id, user_id)
     await update.message.reply_text(f"⚠️ @{username} has {warning_count} warnings.")
 
 async def rmwarn(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -773,9 +972,8 @@ async def rmwarn(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Reply to a user to remove their latest warning.")
         return
     
-    current_warnings = get_user_warnings(chat_id, user_id)
-    if current_warnings > 0:
-        update_user_warnings(chat_id, user_id, current_warnings - 1)
+    remaining = await run_db(decrement_warnings, chat_id, user_id)
+    if remaining is not None:
         await update.message.reply_text("✅ Latest warning removed.")
     else:
         await update.message.reply_text("User has no warnings to remove.")
@@ -794,7 +992,7 @@ async def resetwarn(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Reply to a user to reset their warnings.")
         return
     
-    update_user_warnings(chat_id, user_id, 0)
+    await run_db(reset_warnings, chat_id, user_id)
     await update.message.reply_text("✅ User warnings reset to 0.")
 
 async def resetallwarns(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -805,16 +1003,12 @@ async def resetallwarns(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Only admins can reset all warnings!")
         return
     
-    conn = sqlite3.connect('bot_data.db')
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM warnings WHERE chat_id = ?', (chat_id,))
-    conn.commit()
-    conn.close()
+    await run_db(reset_all_warnings, chat_id)
     await update.message.reply_text("✅ All warnings in this chat have been reset.")
 
 async def warnings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    settings = get_chat_settings(chat_id)
+    settings = await load_chat_settings(chat_id)
     
     warnings_text = f"""
 *⚠️ Warning Settings for this chat:*
@@ -832,13 +1026,13 @@ async def warnmode(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Only admins can change warn mode!")
         return
     
-    settings = get_chat_settings(chat_id)
+    settings = await load_chat_settings(chat_id)
     
     if context.args:
         new_mode = context.args[0].lower()
         if new_mode in ['ban', 'mute', 'kick']:
             settings['warn_mode'] = new_mode
-            set_chat_settings(chat_id, settings)
+            await run_db(set_chat_settings, chat_id, settings)
             await update.message.reply_text(f"✅ Warn mode set to: `{new_mode}`", parse_mode='Markdown')
         else:
             await update.message.reply_text("Invalid mode. Use: ban/mute/kick")
@@ -853,7 +1047,7 @@ async def warnlimit(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Only admins can change warning limit!")
         return
     
-    settings = get_chat_settings(chat_id)
+    settings = await load_chat_settings(chat_id)
     
     if context.args:
         try:
@@ -862,7 +1056,7 @@ async def warnlimit(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text("Warning limit must be at least 1")
                 return
             settings['warn_limit'] = new_limit
-            set_chat_settings(chat_id, settings)
+            await run_db(set_chat_settings, chat_id, settings)
             await update.message.reply_text(f"✅ Warning limit set to: `{new_limit}`", parse_mode='Markdown')
         except ValueError:
             await update.message.reply_text("Please provide a valid number")
@@ -877,72 +1071,386 @@ async def warntime(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Only admins can change warn time!")
         return
     
-    settings = get_chat_settings(chat_id)
+    settings = await load_chat_settings(chat_id)
     
     if context.args:
         new_time = context.args[0].lower()
         if new_time == 'off':
             settings['warn_time'] = 'off'
-            set_chat_settings(chat_id, settings)
+            await run_db(set_chat_settings, chat_id, settings)
             await update.message.reply_text("✅ Warn time disabled - warnings will not expire")
-        else:
+        elif parse_duration(new_time):
             settings['warn_time'] = new_time
-            set_chat_settings(chat_id, settings)
+            await run_db(set_chat_settings, chat_id, settings)
             await update.message.reply_text(f"✅ Warn time set to: `{new_time}`", parse_mode='Markdown')
+        else:
+            await update.message.reply_text("Invalid time. Use e.g. 30m, 6h, 3d, 1w or off")
     else:
         await update.message.reply_text(f"Current warn time: `{settings['warn_time']}`", parse_mode='Markdown')
 
 # Auto-remove links
-async def auto_remove_links(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # Check if we're collecting response for /cmd
-    if context.user_data.get('waiting_for_response'):
+async def remove_links(message_context):
+    message = message_context.message
+    chat_id = message_context.chat.id
+    
+    # Check for links in message
+    hosts = find_links(message)
+    if not hosts:
+        return False
+    
+    # Check if user is admin
+    if await message_context.get('is_admin'):
+        return False  # Admins can post links
+    
+    allowed, denied = await message_context.get('link_rules')
+    if all(is_link_allowed(host, allowed, denied) for host in hosts):
+        return False
+    
+    await message.delete()
+    warning_msg = await message.reply_text("⚠️ Links are not allowed for non-admins!")
+    # Delete warning after 5 seconds
+    await message_context.context.bot.delete_message(chat_id, warning_msg.message_id)
+    return True
+
+# Link allow/deny lists (admin)
+async def set_link_rule_command(update: Update, context: ContextTypes.DEFAULT_TYPE, allowed: bool):
+    chat_id = update.effective_chat.id
+    
+    # Check if user is admin
+    if not await is_admin(update, context):
+        await update.message.reply_text("Only admins can change link rules!")
         return
     
+    command = 'linkallow' if allowed else 'linkdeny'
+    if not context.args:
+        await update.message.reply_text(f"Usage: /{command} <domain>\nExample: /{command} example.com")
+        return
+    
+    domain = host_of(context.args[0])
+    if not domain:
+        await update.message.reply_text("Please provide a valid domain")
+        return
+    
+    await run_db(set_link_rule, chat_id, domain, allowed)
+    if allowed:
+        await update.message.reply_text(f"✅ Links to `{domain}` are now allowed.", parse_mode='Markdown')
+    else:
+        await update.message.reply_text(f"✅ Links to `{domain}` are now always removed.", parse_mode='Markdown')
+
+async def link_allow(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await set_link_rule_command(update, context, allowed=True)
+
+async def link_deny(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await set_link_rule_command(update, context, allowed=False)
+
+async def link_remove(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    
     # Check if user is admin
-    user_id = update.effective_user.id
+    if not await is_admin(update, context):
+        await update.message.reply_text("Only admins can change link rules!")
+        return
+    
+    if not context.args:
+        await update.message.reply_text("Usage: /linkremove <domain>")
+        return
+    
+    domain = host_of(context.args[0])
+    if await run_db(delete_link_rule, chat_id, domain):
+        await update.message.reply_text(f"✅ Rule for `{domain}` removed.", parse_mode='Markdown')
+    else:
+        await update.message.reply_text(f"❌ No rule for `{domain}`.", parse_mode='Markdown')
+
+async def link_rules(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
+    allowed, denied = await run_db(load_link_rules, chat_id)
     
+    if not allowed and not denied:
+        await update.message.reply_text("No link rules set. Links from non-admins are removed.")
+        return
+    
+    rules_text = "🔗 *Link Rules:*\n"
+    if allowed:
+        rules_text += "\nAllowed:\n" + "\n".join(f"• `{domain}`" for domain in sorted(allowed)) + "\n"
+    if denied:
+        rules_text += "\nDenied:\n" + "\n".join(f"• `{domain}`" for domain in sorted(denied)) + "\n"
+    await update.message.reply_text(rules_text, parse_mode='Markdown')
+
+# Profiling (owner only): /profile [seconds] runs cProfile over the event loop,
+# saves the stats under PROFILE_DIR and replies with the hot spots.
+OWNER_IDS = {int(owner) for owner in os.environ.get('OWNER_IDS', '').replace(',', ' ').split()}
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+
+async def run_profile(bot, chat_id, seconds):
     try:
-        if await is_admin(update, context):
-            return  # Admins can post links
-        
-        # Check for links in message
-        message_text = update.message.text or update.message.caption or ""
-        link_pattern = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
-        
-        if re.search(link_pattern, message_text):
-            await update.message.delete()
-            warning_msg = await update.message.reply_text("⚠️ Links are not allowed for non-admins!")
-            # Delete warning after 5 seconds
-            await context.bot.delete_message(chat_id, warning_msg.message_id)
-            
+        path, stats = await profiling.profile_for(seconds, PROFILE_DIR)
+    except Exception as e:
+        logger.error(f"Error profiling: {e}")
+        if chat_id:
+            await bot.send_message(chat_id, f"❌ Profiling failed: {e}")
+        return
+    
+    lines = profiling.hot_spots(stats)
+    logger.info(f"Profile saved to {path}, top functions by own time:\n" + "\n".join(lines))
+    if chat_id:
+        summary = html.escape("\n".join(["     own     cumul   calls function"] + lines))
+        await bot.send_message(
+            chat_id,
+            f"⏱ Profile of {seconds}s saved to <code>{html.escape(path)}</code>\n<pre>{summary}</pre>",
+            parse_mode='HTML'
+        )
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in OWNER_IDS:
+        return
+    
+    if profiling.is_running():
+        await update.message.reply_text("A profile is already running.")
+        return
+    
+    try:
+        seconds = min(max(int(context.args[0]), 1), 600) if context.args else 30
+    except ValueError:
+        await update.message.reply_text("Usage: /profile [seconds]")
+        return
+    
+    await update.message.reply_text(f"⏱ Profiling for {seconds}s...")
+    # Runs in the background so this chat's updates keep flowing
+    context.application.create_task(run_profile(context.bot, update.effective_chat.id, seconds))
+
+# Expired warnings sweeper (JobQueue)
+async def sweep_expired_warnings(context: ContextTypes.DEFAULT_TYPE):
+    deleted = 0
+    try:
+        for chat_id, ttl in await run_db(get_warn_expiry_chats):
+            # Small batches, each its own transaction, so other DB work can run in between
+            while True:
+                batch = await run_db(delete_expired_warnings, chat_id, ttl)
+                deleted += batch
+                if batch < WARN_SWEEP_BATCH:
+                    break
+    except Exception as e:
+        logger.error(f"Error sweeping expired warnings: {e}")
+    
+    if deleted:
+        logger.info(f"Expired {deleted} warnings")
+    
+    # Joins older than JOIN_RETENTION are no longer needed for /banrecent
+    try:
+        while await run_db(delete_old_joins, JOIN_RETENTION) >= WARN_SWEEP_BATCH:
+            pass
+    except Exception as e:
+        logger.error(f"Error pruning old joins: {e}")
+    
+    try:
+        while await run_db(delete_old_mod_actions, MOD_ACTION_RETENTION) >= WARN_SWEEP_BATCH:
+            pass
     except Exception as e:
-        logger.error(f"Error in auto_remove_links: {e}")
+        logger.error(f"Error pruning old moderation actions: {e}")
+
+# Resume moderation actions queued before a restart
+async def start_moderation_workers(context: ContextTypes.DEFAULT_TYPE):
+    moderation_queue.start(context.bot)
+
+# User directory: every user seen in an update (senders, replied-to users,
+# joins, mentions) is remembered so @username resolves without Bot API calls.
+# Only new or renamed users, and last_seen about once a day, reach the DB.
+def users_in_update(update):
+    users = {}
+    
+    def add(user):
+        if user:
+            users[user.id] = (user.id, user.username, user.first_name)
+    
+    add(update.effective_user)
+    message = update.effective_message
+    if message:
+        if message.reply_to_message:
+            add(message.reply_to_message.from_user)
+        for member in message.new_chat_members:
+            add(member)
+        add(message.left_chat_member)
+        for entity in message.entities + message.caption_entities:
+            add(entity.user)
+    if update.chat_member:
+        add(update.chat_member.new_chat_member.user)
+    return list(users.values())
+
+async def track_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    changed = users_to_save(users_in_update(update))
+    if changed:
+        await run_db(save_users, changed)
+
+# Flood and raid detection: FLOOD_LIMIT messages within FLOOD_WINDOW seconds
+# mutes the sender for FLOOD_MUTE seconds; RAID_JOINS joins within RAID_WINDOW
+# seconds mutes every member joining for the next RAID_DURATION seconds.
+FLOOD_MUTE = int(os.environ.get('FLOOD_MUTE', 300))
+flood_detector = FloodDetector(
+    limit=int(os.environ.get('FLOOD_LIMIT', 8)),
+    window=float(os.environ.get('FLOOD_WINDOW', 5)),
+    raid_joins=int(os.environ.get('RAID_JOINS', 10)),
+    raid_window=float(os.environ.get('RAID_WINDOW', 10)),
+    raid_duration=float(os.environ.get('RAID_DURATION', 300))
+)
+
+async def check_flood(message_context):
+    user = message_context.user
+    if not user or message_context.chat.type not in (Chat.GROUP, Chat.SUPERGROUP):
+        return False
+    if not flood_detector.message(message_context.chat.id, user.id):
+        return False
+    if await message_context.get('is_admin'):
+        return False
+    
+    await execute_warn_action(message_context.update, message_context.context, user.id, 'mute',
+                              reason="is flooding the chat", until_date=int(time.time()) + FLOOD_MUTE)
+    return True
+
+async def mute_raid_joins(update: Update, context: ContextTypes.DEFAULT_TYPE, members):
+    chat_id = update.effective_chat.id
+    if flood_detector.joins(chat_id, len(members)):
+        logger.warning(f"Join flood in {chat_id}, muting new members")
+        await context.bot.send_message(
+            chat_id,
+            f"🚨 Join flood detected! New members are muted for the next {int(flood_detector.raid_duration // 60)} minutes."
+        )
+    if not flood_detector.in_raid(chat_id):
+        return False
+    
+    until_date = int(time.time() + flood_detector.raid_ends_in(chat_id))
+    for member in members:
+        try:
+            await context.bot.restrict_chat_member(chat_id, member.id, ChatPermissions.no_permissions(),
+                                                   until_date=until_date)
+        except Exception as e:
+            logger.error(f"Error muting raid join: {e}")
+    return True
+
+# Message pipeline: every regular message goes through these stages in order.
+# Flood counting comes before link removal so deleted messages still count.
+async def load_sender_admin(message_context):
+    return await is_admin(message_context.update, message_context.context)
+
+async def load_commands(message_context):
+    chat_id = message_context.chat.id
+    commands = get_command_index(chat_id)
+    if commands is None:
+        commands = await run_db(load_command_index, chat_id)
+    return commands
+
+async def load_links(message_context):
+    chat_id = message_context.chat.id
+    return get_cached_link_rules(chat_id) or await run_db(load_link_rules, chat_id)
+
+message_pipeline = MessagePipeline({
+    'is_admin': load_sender_admin,
+    'commands': load_commands,
+    'link_rules': load_links,
+})
+message_pipeline.add_stage('cmd_capture', capture_cmd_response)
+message_pipeline.add_stage('flood', check_flood)
+message_pipeline.add_stage('links', remove_links)
+message_pipeline.add_stage('custom_commands', reply_custom_command)
+
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await message_pipeline.run(update, context)
+
+# Welcome message for a batch of joins, rendered when the batch is sent
+async def send_welcome(bot, chat_id, title, members, overflow):
+    settings = await load_chat_settings(chat_id)
+    if not settings['welcome_msg']:
+        return
+    
+    mentions = ', '.join(f"@{member.username}" if member.username else member.first_name for member in members)
+    if overflow:
+        mentions += f" and {overflow} more"
+    welcome_text = settings['welcome_msg']
+    welcome_text = welcome_text.replace('{mention}', mentions)
+    welcome_text = welcome_text.replace('{title}', title or '')
+    await bot.send_message(chat_id, welcome_text)
+
+# Joins within WELCOME_WINDOW seconds share one welcome message
+welcome_batcher = WelcomeBatcher(
+    send_welcome,
+    window=float(os.environ.get('WELCOME_WINDOW', 5)),
+    max_mentions=int(os.environ.get('WELCOME_MAX_MENTIONS', 10))
+)
 
 # New chat member handler
 async def new_chat_members(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    settings = get_chat_settings(chat_id)
+    members = []
+    for member in update.message.new_chat_members:
+        if member.id == context.bot.id:
+            # Bot added to group
+            await update.message.reply_text("Thanks for adding me! Use /help to see my commands.")
+        else:
+            # Regular user joined
+            members.append(member)
     
+    # Joins are remembered for /banrecent
+    if members:
+        await run_db(record_joins, chat_id, [member.id for member in members])
+    
+    # No welcomes while a join flood is going on
+    if not members or await mute_raid_joins(update, context, members):
+        return
+    
+    settings = await load_chat_settings(chat_id)
     if settings['welcome_msg']:
-        for member in update.message.new_chat_members:
-            if member.id == context.bot.id:
-                # Bot added to group
-                await update.message.reply_text("Thanks for adding me! Use /help to see my commands.")
-            else:
-                # Regular user joined
-                welcome_text = settings['welcome_msg']
-                welcome_text = welcome_text.replace('{mention}', f"@{member.username}" if member.username else member.first_name)
-                welcome_text = welcome_text.replace('{title}', update.effective_chat.title)
-                await update.message.reply_text(welcome_text)
+        welcome_batcher.add(context.bot, chat_id, update.effective_chat.title, members)
 
-# Main function with Render.com compatibility
-def main():
-    # Initialize database
-    init_db()
+# Start the metrics endpoint once the application is running
+async def post_init(application: Application):
+    port = get_metrics_port()
+    if port:
+        metrics.start_server(port)
+    
+    # PROFILE_ON_START=<seconds> profiles startup traffic without a command
+    if os.environ.get('PROFILE_ON_START'):
+        application.create_task(run_profile(application.bot, None, int(os.environ['PROFILE_ON_START'])))
+
+# Send welcomes still waiting for their window and let moderation actions in
+# progress finish before the bot shuts down
+async def post_stop(application: Application):
+    await metrics.stop_server()
+    await moderation_queue.stop()
+    await welcome_batcher.flush()
+
+# Release database resources once the application has stopped
+async def post_shutdown(application: Application):
+    # Commit buffered warning/ban writes before closing the database
+    await run_db(flush_writes)
+    close_db()
+
+# Application with every handler and job registered. request replaces the
+# HTTP transport for Bot API calls (used by benchmarks/bench_handlers.py).
+def build_application(request=None, outbound_rate=None, jobs=True):
+    # Updates from different chats run concurrently, each chat stays in order
+    update_processor = ChatOrderedUpdateProcessor(
+        concurrency=int(os.environ.get('UPDATE_CONCURRENCY', 32)),
+        max_pending=int(os.environ.get('UPDATE_MAX_PENDING', 1024))
+    )
+    
+    # Outbound calls are paced under Telegram's flood limits, moderation first
+    rate_limiter = OutboundScheduler(
+        overall_rate=outbound_rate or int(os.environ.get('OUTBOUND_RATE', 30)),
+        group_rate=int(os.environ.get('OUTBOUND_GROUP_RATE', 20))
+    )
     
     # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(update_processor)
+        .rate_limiter(rate_limiter)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request)
+    application = builder.build()
     
     # Add handlers
     application.add_handler(CommandHandler("start", start))
@@ -965,6 +1473,10 @@ def main():
     application.add_handler(CommandHandler("ban", ban_command))
     application.add_handler(CommandHandler("banlist", banlist_command))
     application.add_handler(CommandHandler("unban", unban_command))
+    application.add_handler(CommandHandler("bulkban", bulkban_command))
+    application.add_handler(CommandHandler("bulkunban", bulkunban_command))
+    application.add_handler(CommandHandler("banrecent", banrecent_command))
+    application.add_handler(CommandHandler("purge", purge_command))
     
     # Chat settings commands
     application.add_handler(CommandHandler("welcome", set_welcome))
@@ -972,25 +1484,100 @@ def main():
     application.add_handler(CommandHandler("cmd", set_custom_command))
     application.add_handler(CommandHandler("delcmd", delete_custom_command_cmd))
     application.add_handler(CommandHandler("cmds", list_custom_commands))
+    application.add_handler(CommandHandler("linkallow", link_allow))
+    application.add_handler(CommandHandler("linkdeny", link_deny))
+    application.add_handler(CommandHandler("linkremove", link_remove))
+    application.add_handler(CommandHandler("linkrules", link_rules))
+    application.add_handler(CommandHandler("profile", profile_command))
+    application.add_handler(CallbackQueryHandler(page_callback, pattern=r'^(bl|cm):'))
     
     # User commands
     application.add_handler(CommandHandler("rules", show_rules))
     
     # Message handlers
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_custom_commands))
-    application.add_handler(MessageHandler(filters.TEXT | filters.CAPTION, auto_remove_links))
     application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, new_chat_members))
+    application.add_handler(ChatMemberHandler(chat_member_update, ChatMemberHandler.ANY_CHAT_MEMBER))
+    
+    # The user directory sees every update first
+    application.add_handler(TypeHandler(Update, track_users), group=-2)
+    
+    # Every regular message (commands included) goes through the pipeline
+    # before the handlers above; a stage that deals with it stops them
+    application.add_handler(MessageHandler(~filters.StatusUpdate.ALL, handle_message), group=-1)
+    
+    # Warning expiry; shard 0 (or the only process) resumes queued moderation
+    # actions at startup, other shards start their workers on first use
+    if jobs:
+        application.job_queue.run_repeating(
+            sweep_expired_warnings,
+            interval=int(os.environ.get('WARN_SWEEP_INTERVAL', 300)),
+            first=60
+        )
+        application.job_queue.run_once(start_moderation_workers, 0)
+    
+    # Metrics: every handler is timed, queue sizes are read when scraped
+    metrics.instrument_handlers(application)
+    metrics.Gauge('bot_update_queue_size', 'Updates fetched but not yet handed to the processor.',
+                  application.update_queue.qsize)
+    metrics.Gauge('bot_updates', 'Updates held by the processor, by state.',
+                  lambda: {'pending': update_processor.stats()['pending'], 'running': update_processor.running},
+                  'state')
+    metrics.Gauge('bot_outbound_queue_size', 'Bot API calls waiting for the rate limiter.', rate_limiter.queue_depth)
+    metrics.Gauge('bot_settings_cache', 'Chat settings cache hits, misses and size.', settings_cache_stats, 'stat')
+    metrics.Gauge('bot_user_directory', 'Users and usernames held by the user directory cache.',
+                  user_directory_stats, 'kind')
+    metrics.Gauge('bot_mod_actions_running', 'Moderation actions being carried out.',
+                  lambda: moderation_queue.running)
+    
+    return application
+
+# Shard worker (SHARDS > 1): each shard paces its Bot API calls with an equal
+# share of the overall rate, and only shard 0 runs the warning sweeper
+def build_shard(index, shards):
+    overall_rate = int(os.environ.get('OUTBOUND_RATE', 30))
+    return build_application(outbound_rate=max(1, overall_rate // shards), jobs=index == 0)
+
+# Main function with Render.com compatibility
+def main():
+    # Initialize database
+    init_db()
+    
+    shards = int(os.environ.get('SHARDS', 1))
+    if shards > 1:
+        # This process only receives updates and fans them out by chat_id
+        receiver = ShardedReceiver(build_shard, shards)
+        application = receiver.build_application(
+            Application.builder().token(BOT_TOKEN),
+            post_init=post_init,
+            post_stop=post_stop
+        )
+        print(f"🧩 Sharded mode: {shards} worker processes")
+    else:
+        application = build_application()
     
     # ✅ Render.com compatibility
-    import os
     port = int(os.environ.get('PORT', 8443))
     
     # Start the bot
     print("🤖 Bot is starting...")
     print(f"🌐 Render.com Port: {port}")
     
-    # Run with polling (Render.com compatible)
-    application.run_polling()
+    webhook_url = get_webhook_url()
+    if webhook_url:
+        # Telegram pushes updates to our HTTP server on PORT
+        print(f"🔗 Webhook mode: {webhook_url}")
+        application.run_webhook(
+            listen='0.0.0.0',
+            port=port,
+            url_path=WEBHOOK_PATH,
+            webhook_url=webhook_url,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=ALLOWED_UPDATES
+        )
+    else:
+        # Run with polling (no public URL configured)
+        print("🔁 Polling mode")
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,95 @@
+import time
+from collections import OrderedDict
+
+
+# In-memory flood and raid tracking with sliding-window counters. Each
+# (chat_id, user_id) keeps [window start, count, previous window's count];
+# the rate over the last `window` seconds is estimated by weighting the
+# previous count by how much of it still overlaps. Join storms work the same
+# way per chat. Tables are ordered by last activity, so idle entries are
+# evicted from the front as new messages arrive and memory stays bounded.
+class FloodDetector:
+    def __init__(self, limit=8, window=5.0, raid_joins=10, raid_window=10.0,
+                 raid_duration=300.0, max_entries=100000):
+        self.limit = limit
+        self.window = window
+        self.raid_joins = raid_joins
+        self.raid_window = raid_window
+        self.raid_duration = raid_duration
+        self.max_entries = max_entries
+        self._users = OrderedDict()  # (chat_id, user_id) -> counter
+        self._joins = OrderedDict()  # chat_id -> counter
+        self._raids = {}  # chat_id -> raid mode end time
+        self.floods = 0
+        self.raids = 0
+        self.evicted = 0
+
+    def message(self, chat_id, user_id, now=None):
+        # True when this message takes the user over the limit
+        if now is None:
+            now = time.monotonic()
+        if self._hit(self._users, (chat_id, user_id), 1, self.limit, self.window, now):
+            self.floods += 1
+            return True
+        return False
+
+    def joins(self, chat_id, count, now=None):
+        # True when these joins start raid mode for the chat
+        if now is None:
+            now = time.monotonic()
+        if self.in_raid(chat_id, now):
+            return False
+        if self._hit(self._joins, chat_id, count, self.raid_joins, self.raid_window, now):
+            self._raids[chat_id] = now + self.raid_duration
+            self.raids += 1
+            return True
+        return False
+
+    def in_raid(self, chat_id, now=None):
+        until = self._raids.get(chat_id)
+        if until is None:
+            return False
+        if now is None:
+            now = time.monotonic()
+        if now < until:
+            return True
+        del self._raids[chat_id]
+        return False
+
+    def raid_ends_in(self, chat_id):
+        return max(0.0, self._raids.get(chat_id, 0.0) - time.monotonic())
+
+    def size(self):
+        return len(self._users) + len(self._joins)
+
+    def _hit(self, table, key, amount, limit, window, now):
+        counter = table.get(key)
+        if counter is None:
+            counter = [now, 0, 0]
+            table[key] = counter
+        else:
+            table.move_to_end(key)
+            elapsed = now - counter[0]
+            if elapsed >= window:
+                counter[2] = counter[1] if elapsed < 2 * window else 0
+                counter[1] = 0
+                counter[0] = now - elapsed % window
+        counter[1] += amount
+        self._evict(table, now - 2 * window)
+
+        overlap = 1 - (now - counter[0]) / window
+        if counter[1] + counter[2] * overlap >= limit:
+            # Start counting again so one burst trips only once
+            counter[:] = [now, 0, 0]
+            return True
+        return False
+
+    def _evict(self, table, cutoff):
+        # The front entry is the least recently active one. A counter whose
+        # window started 2 windows ago no longer affects the estimate.
+        while table:
+            key, counter = next(iter(table.items()))
+            if len(table) <= self.max_entries and counter[0] >= cutoff:
+                break
+            del table[key]
+            self.evicted += 1
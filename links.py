@@ -0,0 +1,95 @@
+import re
+
+from telegram import MessageEntity
+
+# Common TLDs accepted for links written without a scheme, so that file names
+# like "setup.py" or "notes.txt" are not treated as links by the fallback.
+_BARE_TLDS = frozenset((
+    'com', 'net', 'org', 'info', 'biz', 'io', 'co', 'me', 'app', 'dev', 'xyz',
+    'top', 'site', 'online', 'store', 'shop', 'club', 'live', 'link', 'click',
+    'ru', 'ua', 'by', 'kz', 'uz', 'in', 'bd', 'pk', 'id', 'ir', 'tr', 'br',
+    'us', 'uk', 'de', 'fr', 'it', 'es', 'nl', 'pl', 'cn', 'jp', 'tv', 'cc',
+    'ly', 'gl', 'gg', 'to', 'su', 'ws',
+))
+
+_URL_ENTITY_TYPES = [MessageEntity.URL, MessageEntity.TEXT_LINK]
+_URL_ENTITY_SET = frozenset(_URL_ENTITY_TYPES)
+
+# Fallback matcher for text that arrives without entities, applied to each
+# whitespace-separated token that contains a dot. Schemes are optional; the
+# host is captured so it can be checked against the chat's domain lists.
+_LINK_RE = re.compile(
+    r'(?P<scheme>[a-z][a-z0-9+.-]{1,15}://(?:[^\s/@]+@)?|www\.)?'
+    r'(?P<host>(?:[a-z0-9-]{1,63}\.)+(?P<tld>[a-z]{2,24}|xn--[a-z0-9-]{1,59})|\d{1,3}(?:\.\d{1,3}){3})'
+    r'(?![\w-])',
+    re.IGNORECASE,
+)
+_TOKEN_PUNCTUATION = '.()[]{}<>"\'«»,;:!?*_`~'
+_PATH_START = re.compile(r'[/?#]')
+
+
+def host_of(url):
+    url = url.strip().lower()
+    scheme_end = url.find('://')
+    if scheme_end != -1:
+        url = url[scheme_end + 3:]
+    host = _PATH_START.split(url, 1)[0]
+    host = host.rpartition('@')[2].partition(':')[0].rstrip('.')
+    if host.startswith('www.'):
+        host = host[4:]
+    return host
+
+
+def _hosts_in_text(text):
+    if not text or '.' not in text:
+        return []
+    hosts = []
+    for token in text.split():
+        if '.' not in token:
+            continue
+        token = token.strip(_TOKEN_PUNCTUATION)
+        match = '.' in token and _LINK_RE.match(token)
+        if not match:
+            continue
+        tld = match.group('tld')
+        if match.group('scheme') or (tld and tld.lower() in _BARE_TLDS):
+            hosts.append(host_of(match.group('host')))
+    return hosts
+
+
+def _hosts_in_entities(entities, parse):
+    # Most entities are formatting or mentions; only decode the text when a
+    # url/text_link entity is actually present.
+    for entity in entities:
+        if entity.type in _URL_ENTITY_SET:
+            break
+    else:
+        return []
+
+    hosts = []
+    for entity, text in parse(_URL_ENTITY_TYPES).items():
+        hosts.append(host_of(entity.url if entity.type == MessageEntity.TEXT_LINK else text))
+    return hosts
+
+
+def find_links(message):
+    # Telegram already parses url and text_link entities; only scan the raw
+    # text ourselves when the message carries no entities at all.
+    if message.entities:
+        return _hosts_in_entities(message.entities, message.parse_entities)
+    if message.caption_entities:
+        return _hosts_in_entities(message.caption_entities, message.parse_caption_entities)
+    return _hosts_in_text(message.text or message.caption)
+
+
+def is_link_allowed(host, allowed, denied):
+    # The most specific matching domain wins: allowing example.com also
+    # allows docs.example.com unless docs.example.com is denied.
+    domain = host
+    while domain:
+        if domain in denied:
+            return False
+        if domain in allowed:
+            return True
+        domain = domain.partition('.')[2]
+    return False
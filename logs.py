@@ -0,0 +1,117 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+# Repeated warnings and errors from the same call site (file and line) are
+# let through `burst` times per `window` seconds; the rest are dropped and
+# counted, and the count is appended to the next message that gets through.
+class RateLimitFilter(logging.Filter):
+    def __init__(self, burst=5, window=60.0, level=logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.level = level
+        self._sites = {}  # (pathname, lineno) -> [window start, passed, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < self.level:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= self.window:
+                suppressed = site[2] if site else 0
+                self._sites[key] = [now, 1, 0]
+            elif site[1] < self.burst:
+                site[1] += 1
+                return True
+            else:
+                site[2] += 1
+                return False
+        if suppressed:
+            record.msg = f"{record.msg} (suppressed {suppressed} similar messages)"
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+_listener = None
+_handlers = []
+_filter = None
+
+
+def setup_logging(path='bot.log', level=logging.INFO, max_bytes=10 * 1024 * 1024, backups=3,
+                  json_output=False, burst=5, window=60.0):
+    # Loggers only put records on a queue; a listener thread formats them and
+    # writes to the rotating file and the console, so logging never blocks
+    # the event loop on disk or terminal I/O.
+    global _listener, _filter
+    formatter = JsonFormatter() if json_output else logging.Formatter(LOG_FORMAT)
+    file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                                        encoding='utf-8')
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    _handlers[:] = [file_handler, stream_handler]
+    _filter = RateLimitFilter(burst, window)
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(_filter)
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+
+    # Request lines from the HTTP clients would otherwise dominate the log
+    for name in ('httpx', 'httpcore'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, *_handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def listen(log_queue):
+    # Write records that other processes put on log_queue (see
+    # setup_worker_logging) through this process's handlers
+    listener = logging.handlers.QueueListener(log_queue, *_handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def setup_worker_logging(log_queue):
+    # Child processes hand their records to the parent instead of writing
+    # (and rotating) the same files themselves
+    stop_logging()
+    for handler in _handlers:
+        handler.close()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(_filter or RateLimitFilter())
+    logging.getLogger().handlers[:] = [queue_handler]
+
+
+def stop_logging():
+    # Write out whatever is still queued
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
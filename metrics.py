@@ -0,0 +1,194 @@
+import bisect
+import functools
+import logging
+import time
+
+import tornado.httpserver
+import tornado.web
+from telegram.ext import ApplicationHandlerStop
+
+logger = logging.getLogger(__name__)
+
+# Prometheus text-format metrics without extra dependencies. Every metric has
+# at most one label; observations happen on the event loop thread, so plain
+# dicts and lists are enough and an observe() is a bisect plus two additions.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+
+def _labels(label, value, extra=''):
+    pairs = []
+    if value is not None:
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{label}="{escaped}"')
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.values = {}
+        _registry.append(self)
+
+    def inc(self, value=None, amount=1):
+        self.values[value] = self.values.get(value, 0) + amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} counter'
+        for value, count in self.values.items():
+            yield f'{self.name}{_labels(self.label, value)} {count}'
+
+
+class Histogram:
+    def __init__(self, name, help_text, label=None, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self.series = {}  # label value -> [count per bucket..., +Inf count, sum]
+        _registry.append(self)
+
+    def observe(self, seconds, value=None):
+        series = self.series.get(value)
+        if series is None:
+            series = [0] * (len(self.buckets) + 2)
+            self.series[value] = series
+        series[bisect.bisect_left(self.buckets, seconds)] += 1
+        series[-1] += seconds
+
+    def time(self, value=None):
+        return _Timer(self, value)
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} histogram'
+        for value, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                le = 'le="%s"' % bound
+                yield f'{self.name}_bucket{_labels(self.label, value, le)} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.label, value)} {series[-1]}'
+            yield f'{self.name}_count{_labels(self.label, value)} {cumulative}'
+
+
+class _Timer:
+    def __init__(self, histogram, value):
+        self.histogram = histogram
+        self.value = value
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, self.value)
+
+
+class Gauge:
+    # Read when scraped: func returns a number or a dict of label value -> number
+    def __init__(self, name, help_text, func, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.func = func
+        self.label = label
+        _registry.append(self)
+
+    def render(self):
+        try:
+            values = self.func()
+        except Exception as e:
+            logger.error(f"Error reading gauge {self.name}: {e}")
+            return
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} gauge'
+        if not isinstance(values, dict):
+            values = {None: values}
+        for value, number in values.items():
+            yield f'{self.name}{_labels(self.label, value)} {number}'
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Metrics shared by the modules that record them
+HANDLER_SECONDS = Histogram('bot_handler_seconds', 'Handler callback latency.', 'handler')
+HANDLER_ERRORS = Counter('bot_handler_errors_total', 'Exceptions raised by handler callbacks.', 'handler')
+DB_SECONDS = Histogram('bot_db_seconds', 'run_db time per helper, including time queued for the DB thread.', 'helper')
+API_SECONDS = Histogram('bot_api_seconds', 'Bot API call latency, excluding time paced by the rate limiter.', 'method')
+API_CALLS = Counter('bot_api_calls_total', 'Bot API calls made.', 'method')
+API_ERRORS = Counter('bot_api_errors_total', 'Bot API calls that raised an error.', 'method')
+API_RETRY_AFTER = Counter('bot_api_retry_after_total', 'Bot API calls answered with RetryAfter.', 'method')
+API_WAIT_SECONDS = Histogram('bot_api_wait_seconds', 'Time Bot API calls waited for the rate limiter.', 'method')
+MOD_ACTIONS = Counter('bot_mod_actions_total', 'Moderation actions by outcome (done, retried, failed, duplicate).',
+                      'outcome')
+UPDATE_WAIT_SECONDS = Histogram('bot_update_wait_seconds', 'Time updates waited for their chat and a worker slot.')
+PIPELINE_STAGE_SECONDS = Histogram('bot_pipeline_stage_seconds', 'Message pipeline time per stage.', 'stage')
+UPDATE_LAG_SECONDS = Histogram('bot_update_lag_seconds', 'Time from the message date to handling it.',
+                               buckets=(0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0))
+
+
+def instrument_handlers(application):
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = _timed_callback(handler.callback)
+
+
+def _timed_callback(callback):
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def timed(update, context):
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - start, name)
+
+    return timed
+
+
+# HTTP endpoint: /metrics for scrapers, / as a health check
+class _MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(render())
+
+
+class _HealthHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write('ok')
+
+
+_server = None
+
+
+def start_server(port, address='0.0.0.0'):
+    global _server
+    app = tornado.web.Application([(r'/metrics', _MetricsHandler), (r'/', _HealthHandler)])
+    _server = tornado.httpserver.HTTPServer(app)
+    _server.listen(port, address)
+    logger.info(f"Metrics on http://{address}:{port}/metrics")
+
+
+async def stop_server():
+    global _server
+    if _server is not None:
+        _server.stop()
+        await _server.close_all_connections()
+        _server = None
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+from metrics import MOD_ACTIONS
+from storage import run_db, enqueue_mod_action, claim_mod_action, finish_mod_action
+
+logger = logging.getLogger(__name__)
+
+
+# Moderation actions (ban, kick, mute) are queued in SQLite and carried out by
+# a pool of worker tasks, so the handler that issues one returns at once.
+# Each action carries an idempotency key naming the update that caused it; a
+# key is only ever queued once, so an update delivered again after a restart
+# does not punish twice. Failed calls are retried with exponential backoff,
+# RetryAfter waits as long as Telegram asks, and BadRequest/Forbidden (no
+# rights, user is an admin, user gone) fail right away.
+class ModerationQueue:
+    def __init__(self, perform, on_failure=None, workers=4, max_attempts=6,
+                 base_delay=2.0, max_delay=300.0, lease=300, idle_wait=60.0):
+        self.perform = perform  # async perform(bot, chat_id, user_id, action, reason, until_date, issued_by)
+        self.on_failure = on_failure  # async on_failure(bot, chat_id, user_id, action, error)
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease = lease  # seconds a claimed action is reserved for its worker
+        self.idle_wait = idle_wait
+        self.bot = None
+        self._tasks = []
+        self._wake = None
+        self._stopping = False
+        self.running = 0
+
+    def start(self, bot):
+        # Idempotent; workers pick up actions left over from earlier runs too
+        if self._tasks:
+            return
+        self.bot = bot
+        self._stopping = False
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._work(), name=f'mod-action-{index}')
+                       for index in range(self.workers)]
+
+    async def submit(self, bot, key, chat_id, user_id, action, reason=None, until_date=None, issued_by=None):
+        # False if an action with this key was already queued
+        action_id = await run_db(enqueue_mod_action, key, chat_id, user_id, action, reason, until_date, issued_by)
+        if action_id is None:
+            MOD_ACTIONS.inc('duplicate')
+            logger.info(f"Moderation action {key} already queued")
+            return False
+        self.start(bot)
+        self._wake.set()
+        return True
+
+    async def stop(self, timeout=10.0):
+        # Let actions in progress finish; unfinished ones run after a restart
+        if not self._tasks:
+            return
+        self._stopping = True
+        self._wake.set()
+        tasks, self._tasks = self._tasks, []
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _work(self):
+        while not self._stopping:
+            # Cleared before claiming, so a submit after this point wakes us
+            self._wake.clear()
+            try:
+                row, wait = await run_db(claim_mod_action, self.lease)
+            except Exception as e:
+                logger.error(f"Error claiming moderation action: {e}")
+                row, wait = None, self.idle_wait
+            if row is None:
+                timeout = self.idle_wait if wait is None else min(max(wait, 0.1), self.idle_wait)
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self.running += 1
+            try:
+                await self._run(row)
+            finally:
+                self.running -= 1
+
+    async def _run(self, row):
+        action_id, chat_id, user_id, action, reason, until_date, issued_by, attempts = row
+        error = None
+        try:
+            await self.perform(self.bot, chat_id, user_id, action, reason, until_date, issued_by)
+            status, delay = 'done', 0
+        except (BadRequest, Forbidden) as e:
+            status, delay, error = 'failed', 0, e
+        except Exception as e:
+            error = e
+            if attempts >= self.max_attempts:
+                status, delay = 'failed', 0
+            elif isinstance(e, RetryAfter):
+                retry_after = e.retry_after
+                if not isinstance(retry_after, (int, float)):
+                    retry_after = retry_after.total_seconds()
+                status, delay = 'pending', retry_after
+            else:
+                status, delay = 'pending', min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        if status == 'pending':
+            delay = max(1, round(delay))
+
+        MOD_ACTIONS.inc('retried' if status == 'pending' else status)
+        if status == 'pending':
+            logger.warning(f"Moderation action {action_id} ({action} {user_id} in {chat_id}) failed: {error}, "
+                           f"retrying in {delay}s")
+        elif status == 'failed':
+            logger.error(f"Moderation action {action_id} ({action} {user_id} in {chat_id}) failed: {error}")
+
+        try:
+            await run_db(finish_mod_action, action_id, status, delay, str(error) if error else None)
+        except Exception as e:
+            logger.error(f"Error recording moderation action {action_id}: {e}")
+
+        if status == 'failed' and self.on_failure:
+            try:
+                await self.on_failure(self.bot, chat_id, user_id, action, error)
+            except Exception as e:
+                logger.error(f"Error reporting failed moderation action {action_id}: {e}")
@@ -0,0 +1,196 @@
+import asyncio
+import bisect
+import itertools
+import logging
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import API_CALLS, API_ERRORS, API_RETRY_AFTER, API_SECONDS, API_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Request priorities (lower goes first)
+PRIORITY_MODERATION = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_CHATTER = 2
+
+MODERATION_ENDPOINTS = frozenset((
+    'banChatMember',
+    'unbanChatMember',
+    'restrictChatMember',
+    'deleteMessage',
+    'deleteMessages',
+    'banChatSenderChat',
+))
+
+
+def default_priority(endpoint):
+    if endpoint in MODERATION_ENDPOINTS:
+        return PRIORITY_MODERATION
+    if endpoint.startswith(('send', 'copy', 'forward')):
+        return PRIORITY_CHATTER
+    return PRIORITY_DEFAULT
+
+
+def counts_as_message(endpoint):
+    # Telegram's per-group limit applies to messages posted in the group
+    return endpoint.startswith(('send', 'copy', 'forward'))
+
+
+class TokenBucket:
+    # Allows at most `limit` requests in any `period`-second window: up to
+    # `burst` at once, refilled at (limit - burst) / period per second.
+    def __init__(self, limit, period, burst):
+        self.rate = (limit - burst) / period
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def wait_time(self, now):
+        # Seconds until one token is available
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = max(0.0, (1 - self.tokens) / self.rate)
+        return max(wait, self.blocked_until - now)
+
+    def take(self):
+        self.tokens -= 1
+
+    def idle(self, now):
+        return self.wait_time(now) == 0 and self.tokens >= self.capacity
+
+
+# Outbound request scheduler: a global token bucket plus one bucket per group
+# chat. Waiting requests are granted in priority order (moderation before
+# chatter), FIFO within a priority, skipping requests whose group bucket is
+# empty so one busy group never holds up the others. RetryAfter pauses the
+# affected group's messages (or everything else) and retries the request.
+class OutboundScheduler(BaseRateLimiter):
+    def __init__(self, overall_rate=30, group_rate=20, group_period=60,
+                 overall_burst=5, group_burst=3, max_retries=3):
+        self.group_rate = group_rate
+        self.group_period = group_period
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(overall_rate, 1, overall_burst)
+        self._groups = {}
+        self._waiting = []  # sorted (priority, seq, future, group chat_id or None)
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._dispatcher = None
+
+    async def initialize(self):
+        # ExtBot.initialize runs again for the updater; keep one dispatcher
+        if self._dispatcher is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for _, _, future, _ in self._waiting:
+            future.cancel()
+        self._waiting.clear()
+
+    def queue_depth(self):
+        return len(self._waiting)
+
+    def _group_bucket(self, chat_id):
+        bucket = self._groups.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.group_rate, self.group_period, self.group_burst)
+            self._groups[chat_id] = bucket
+        return bucket
+
+    async def _acquire(self, priority, group):
+        future = asyncio.get_running_loop().create_future()
+        bisect.insort(self._waiting, (priority, next(self._seq), future, group),
+                      key=lambda item: item[:2])
+        self._wakeup.set()
+        await future
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            sleep = None
+            granted = []
+
+            for item in self._waiting:
+                _, _, future, group = item
+                if future.done():
+                    granted.append(item)
+                    continue
+                wait = self._global.wait_time(now)
+                if wait > 0:
+                    sleep = wait if sleep is None else min(sleep, wait)
+                    break
+                if group is not None:
+                    wait = self._group_bucket(group).wait_time(now)
+                    if wait > 0:
+                        sleep = wait if sleep is None else min(sleep, wait)
+                        continue
+                    self._group_bucket(group).take()
+                self._global.take()
+                future.set_result(None)
+                granted.append(item)
+
+            for item in granted:
+                self._waiting.remove(item)
+
+            # Forget full, idle group buckets
+            if len(self._groups) > 1000:
+                for chat_id in [c for c, b in self._groups.items() if b.idle(now)]:
+                    del self._groups[chat_id]
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=sleep)
+            except asyncio.TimeoutError:
+                pass
+
+    def _pause(self, group, retry_after):
+        until = time.monotonic() + retry_after
+        bucket = self._group_bucket(group) if group is not None else self._global
+        bucket.blocked_until = max(bucket.blocked_until, until)
+        self._wakeup.set()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = rate_limit_args if isinstance(rate_limit_args, int) else default_priority(endpoint)
+        chat_id = data.get('chat_id')
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+        group = chat_id if isinstance(chat_id, int) and chat_id < 0 and counts_as_message(endpoint) else None
+
+        for attempt in range(self.max_retries + 1):
+            with API_WAIT_SECONDS.time(endpoint):
+                await self._acquire(priority, group)
+            API_CALLS.inc(endpoint)
+            start = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                API_RETRY_AFTER.inc(endpoint)
+                if attempt == self.max_retries:
+                    API_ERRORS.inc(endpoint)
+                    raise
+                retry_after = exc.retry_after
+                if not isinstance(retry_after, (int, float)):
+                    retry_after = retry_after.total_seconds()
+                logger.info(f"Flood limit on {endpoint}, retrying in {retry_after}s")
+                self._pause(group, retry_after + 0.1)
+            except Exception:
+                API_ERRORS.inc(endpoint)
+                raise
+            finally:
+                API_SECONDS.observe(time.perf_counter() - start, endpoint)
@@ -0,0 +1,57 @@
+import logging
+import time
+
+from telegram.ext import ApplicationHandlerStop
+
+from metrics import PIPELINE_STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# One handler for every regular message instead of MessageHandlers competing
+# for it. Stages run in order over a MessageContext shared for the update; a
+# stage returns True once it has dealt with the message (captured, deleted,
+# sender muted), which ends the pipeline and stops later handler groups.
+# Per-update facts (admin status, command index, link rules) are loaded by
+# the named loaders on first use, so every stage shares one lookup.
+
+
+class MessageContext:
+    def __init__(self, update, context, loaders):
+        self.update = update
+        self.context = context
+        self.message = update.effective_message
+        self.chat = update.effective_chat
+        self.user = update.effective_user
+        self._loaders = loaders
+        self._values = {}
+
+    async def get(self, name):
+        if name not in self._values:
+            self._values[name] = await self._loaders[name](self)
+        return self._values[name]
+
+
+class MessagePipeline:
+    def __init__(self, loaders=None):
+        # loaders: name -> async function(MessageContext)
+        self.loaders = dict(loaders or {})
+        self.stages = []
+
+    def add_stage(self, name, stage):
+        # stage: async function(MessageContext) -> True to stop
+        self.stages.append((name, stage))
+
+    async def run(self, update, context):
+        message_context = MessageContext(update, context, self.loaders)
+        for name, stage in self.stages:
+            start = time.perf_counter()
+            try:
+                done = await stage(message_context)
+            except Exception as e:
+                # One failing stage must not take the others down with it
+                logger.error(f"Error in {name} stage: {e}")
+                done = False
+            finally:
+                PIPELINE_STAGE_SECONDS.observe(time.perf_counter() - start, name)
+            if done:
+                raise ApplicationHandlerStop
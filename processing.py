@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from metrics import UPDATE_LAG_SECONDS, UPDATE_WAIT_SECONDS
+
+
+# Concurrent update processing that keeps updates from the same chat in order.
+# max_pending bounds the updates held by the processor (running or waiting for
+# their chat); concurrency bounds how many handlers run at the same time. An
+# update only takes a worker slot once every earlier update from its chat has
+# finished, so one busy chat can't starve the others.
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, concurrency=32, max_pending=1024):
+        super().__init__(max_concurrent_updates=max_pending)
+        self.concurrency = concurrency
+        self._workers = None
+        self._tails = {}  # chat key -> future resolved when its last queued update is done
+        self._depths = {}  # chat key -> updates running or waiting
+        self.running = 0
+        self.processed = 0
+        self.max_depth_seen = 0
+
+    async def initialize(self):
+        self._workers = asyncio.Semaphore(self.concurrency)
+
+    async def shutdown(self):
+        pass
+
+    def queue_depths(self):
+        return dict(self._depths)
+
+    def stats(self):
+        return {
+            'chats_queued': len(self._depths),
+            'pending': sum(self._depths.values()),
+            'running': self.running,
+            'processed': self.processed,
+            'max_depth_seen': self.max_depth_seen,
+        }
+
+    @staticmethod
+    def _chat_key(update):
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return ('user', update.effective_user.id)
+        return None
+
+    async def _run(self, update, coroutine, queued_at):
+        async with self._workers:
+            UPDATE_WAIT_SECONDS.observe(time.monotonic() - queued_at)
+            message = update.effective_message if isinstance(update, Update) else None
+            if message is not None and message.date is not None:
+                UPDATE_LAG_SECONDS.observe(max(0.0, time.time() - message.date.timestamp()))
+            self.running += 1
+            try:
+                await coroutine
+            finally:
+                self.running -= 1
+                self.processed += 1
+
+    async def do_process_update(self, update, coroutine):
+        queued_at = time.monotonic()
+        key = self._chat_key(update)
+        if key is None:
+            await self._run(update, coroutine, queued_at)
+            return
+
+        previous = self._tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+        depth = self._depths.get(key, 0) + 1
+        self._depths[key] = depth
+        self.max_depth_seen = max(self.max_depth_seen, depth)
+
+        try:
+            if previous is not None:
+                await previous
+            await self._run(update, coroutine, queued_at)
+        finally:
+            done.set_result(None)
+            if self._tails.get(key) is done:
+                del self._tails[key]
+            if self._depths[key] == 1:
+                del self._depths[key]
+            else:
+                self._depths[key] -= 1
@@ -0,0 +1,48 @@
+import asyncio
+import cProfile
+import os
+import pstats
+import time
+
+# On-demand cProfile of the event loop thread (update processing, handlers,
+# Bot API calls). Nothing is installed until a window starts, so there is no
+# overhead otherwise; DB helpers run on the DB thread and only show up as the
+# time handlers spend awaiting run_db.
+_running = False
+
+
+def is_running():
+    return _running
+
+
+async def profile_for(seconds, directory):
+    # Profile the event loop for `seconds`, dump the stats to `directory` and
+    # return (path, pstats.Stats)
+    global _running
+    if _running:
+        raise RuntimeError("A profile is already running")
+    _running = True
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+    finally:
+        _running = False
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, time.strftime('profile-%Y%m%d-%H%M%S.prof'))
+    profile.dump_stats(path)
+    return path, pstats.Stats(profile)
+
+
+def hot_spots(stats, limit=10):
+    # Top functions by own time, one short line each
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)
+    lines = []
+    for (filename, line, name), (_, calls, own, cumulative, _) in rows[:limit]:
+        where = f"{os.path.basename(filename)}:{line}" if line else filename
+        lines.append(f"{own * 1000:8.1f}ms {cumulative * 1000:8.1f}ms {calls:>7} {name} ({where})")
+    return lines
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+import logs
+
+logger = logging.getLogger(__name__)
+
+# Sharded mode: one receiver process takes updates from Telegram (polling or
+# webhook) and forwards each one to the worker process that owns its chat,
+# chosen by chat_id % shards. Workers run the full handler set, so all
+# per-chat state (settings, command index, admin rosters, flood counters,
+# welcome batches, update ordering) lives in exactly one process. SQLite in
+# WAL mode is shared through each process's own connection.
+_BATCH = 256
+
+
+def shard_of(update, shards):
+    chat = update.effective_chat if isinstance(update, Update) else None
+    return chat.id % shards if chat else 0
+
+
+class ShardedReceiver:
+    def __init__(self, build_worker, shards):
+        # build_worker(index, shards) -> Application, run in each worker.
+        # It must be importable by name, since workers are spawned.
+        self.build_worker = build_worker
+        self.shards = shards
+        context = multiprocessing.get_context('spawn')
+        self.log_queue = context.Queue()
+        self.queues = [context.Queue() for _ in range(shards)]
+        self._ready = context.Semaphore(0)
+        self.processes = [
+            context.Process(target=worker_main, name=f'shard-{index}',
+                            args=(build_worker, index, shards, self.queues[index], self.log_queue, self._ready))
+            for index in range(shards)
+        ]
+        self.forwarded = [0] * shards
+        self._log_listener = None
+
+    def start(self):
+        self._log_listener = logs.listen(self.log_queue)
+        for process in self.processes:
+            process.start()
+        logger.info(f"Started {self.shards} shard workers")
+
+    def wait_ready(self, timeout=60):
+        # Blocks until every worker is processing updates
+        for _ in range(self.shards):
+            if not self._ready.acquire(timeout=timeout):
+                return False
+        return True
+
+    def stop(self, timeout=30):
+        for updates in self.queues:
+            updates.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.error(f"{process.name} did not stop, terminating")
+                process.terminate()
+        if self._log_listener is not None:
+            self._log_listener.stop()
+            self._log_listener = None
+
+    async def forward(self, update: Update, context):
+        index = shard_of(update, self.shards)
+        self.forwarded[index] += 1
+        self.queues[index].put(update.to_dict())
+
+    def build_application(self, builder, post_init=None, post_stop=None):
+        # Receiver Application: no handlers besides forwarding. Workers are
+        # started before post_init and stopped after post_stop.
+        async def started(application):
+            self.start()
+            if post_init:
+                await post_init(application)
+
+        async def stopped(application):
+            if post_stop:
+                await post_stop(application)
+            self.stop()
+
+        application = builder.post_init(started).post_stop(stopped).build()
+        application.add_handler(TypeHandler(Update, self.forward))
+        return application
+
+
+def worker_main(build_worker, index, shards, updates, log_queue, ready):
+    logs.setup_worker_logging(log_queue)
+    asyncio.run(_serve(build_worker(index, shards), updates, ready))
+
+
+async def _serve(application, updates, ready):
+    await application.initialize()
+    await application.start()
+    ready.release()
+    loop = asyncio.get_running_loop()
+    running = True
+    while running:
+        # Block in a thread for the next update, then take whatever else is queued
+        batch = [await loop.run_in_executor(None, updates.get)]
+        while len(batch) < _BATCH:
+            try:
+                batch.append(updates.get_nowait())
+            except queue.Empty:
+                break
+        for data in batch:
+            if data is None:
+                running = False
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+
+    # Let queued updates finish before stopping
+    while not application.update_queue.empty():
+        await asyncio.sleep(0.05)
+    await application.stop()
+    if application.post_stop:
+        await application.post_stop(application)
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
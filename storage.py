@@ -0,0 +1,925 @@
+import os
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import re
+
+from metrics import DB_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Database location (Render.com disk is mounted on the project directory)
+DB_PATH = os.environ.get('DB_PATH', 'bot_data.db')
+
+# Connection tuning
+_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-8000',
+    'PRAGMA foreign_keys=ON',
+)
+_BUSY_TIMEOUT = 30
+_STATEMENT_CACHE_SIZE = 256
+
+# Number of chats whose custom commands are kept in memory
+COMMAND_INDEX_CHATS = int(os.environ.get('COMMAND_INDEX_CHATS', 1024))
+
+# Number of chats whose settings are kept in memory
+SETTINGS_CACHE_CHATS = int(os.environ.get('SETTINGS_CACHE_CHATS', 4096))
+
+# Number of users kept in memory by the user directory, and how often a
+# user's last_seen is refreshed on disk when nothing else about them changed
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 50000))
+USER_SEEN_INTERVAL = int(os.environ.get('USER_SEEN_INTERVAL', 86400))
+
+# Group commit for warning/ban writes: commit every N ms or M writes
+GROUP_COMMIT_INTERVAL = int(os.environ.get('GROUP_COMMIT_MS', 50)) / 1000
+GROUP_COMMIT_OPS = int(os.environ.get('GROUP_COMMIT_OPS', 200))
+
+# One long-lived connection per thread. sqlite3 keeps a per-connection cache of
+# prepared statements keyed by SQL text, so every query below is a module-level
+# constant and is only parsed once per connection.
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+
+
+def get_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(
+            DB_PATH,
+            timeout=_BUSY_TIMEOUT,
+            cached_statements=_STATEMENT_CACHE_SIZE,
+            check_same_thread=False,
+        )
+        for pragma in _PRAGMAS:
+            conn.execute(pragma)
+        _local.conn = conn
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+
+# Async access: handlers never touch sqlite3 on the event loop. Every call is
+# queued to one dedicated DB thread, which owns its own long-lived connection,
+# so writes are serialized without lock contention between connections.
+_executor = None
+_executor_lock = threading.Lock()
+_db_thread = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=1,
+                    thread_name_prefix='db',
+                    initializer=_mark_db_thread,
+                )
+    return _executor
+
+
+def _mark_db_thread():
+    global _db_thread
+    _db_thread = threading.get_ident()
+
+
+async def run_db(func, *args):
+    loop = asyncio.get_running_loop()
+    with DB_SECONDS.time(func.__name__):
+        return await loop.run_in_executor(_get_executor(), func, *args)
+
+
+# Write-behind: warning and ban writes made on the DB thread join one open
+# transaction that is committed every GROUP_COMMIT_INTERVAL seconds or
+# GROUP_COMMIT_OPS writes, whichever comes first. Every read also runs on the
+# DB thread's connection, so pending writes are visible before they commit.
+_pending_writes = 0
+_flush_timer = None
+_write_stats = {'writes': 0, 'commits': 0}
+
+
+def write_stats():
+    return dict(_write_stats, pending=_pending_writes)
+
+
+def flush_writes():
+    global _pending_writes, _flush_timer
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and conn.in_transaction:
+        conn.commit()
+        _write_stats['commits'] += 1
+
+    if threading.get_ident() == _db_thread:
+        _pending_writes = 0
+        if _flush_timer is not None:
+            _flush_timer.cancel()
+            _flush_timer = None
+
+
+def _schedule_flush():
+    with _executor_lock:
+        if _executor is not None:
+            _executor.submit(flush_writes)
+
+
+def _buffered_write(sql, params, returning=False, many=False):
+    global _pending_writes, _flush_timer
+    conn = get_connection()
+    cursor = conn.executemany(sql, params) if many else conn.execute(sql, params)
+    if returning:
+        # RETURNING rows must be read before the transaction can commit
+        cursor = cursor.fetchall()
+    _write_stats['writes'] += 1
+
+    if threading.get_ident() != _db_thread:
+        # Callers outside the DB thread (startup, scripts) commit right away
+        flush_writes()
+        return cursor
+
+    _pending_writes += 1
+    if _pending_writes >= GROUP_COMMIT_OPS:
+        flush_writes()
+    elif _flush_timer is None:
+        _flush_timer = threading.Timer(GROUP_COMMIT_INTERVAL, _schedule_flush)
+        _flush_timer.daemon = True
+        _flush_timer.start()
+    return cursor
+
+
+def close_db():
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.submit(flush_writes)
+        executor.shutdown(wait=True)
+
+    with _connections_lock:
+        while _connections:
+            conn = _connections.pop()
+            try:
+                conn.commit()
+                conn.close()
+            except sqlite3.Error:
+                pass
+    _local.__dict__.clear()
+    with _command_index_lock:
+        _command_index.clear()
+    with _settings_lock:
+        _settings_cache.clear()
+    with _link_rules_lock:
+        _link_rules.clear()
+    with _users_lock:
+        _users.clear()
+        _usernames.clear()
+
+
+# Schema migrations. PRAGMA user_version is the number of migrations applied;
+# init_db runs the rest in order, each committing before the version is bumped,
+# so an interrupted migration is simply run again on the next start.
+def _migration_initial_schema(conn):
+    with conn:
+        # Warnings table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS warnings (
+                chat_id INTEGER,
+                user_id INTEGER,
+                warnings INTEGER DEFAULT 0,
+                last_warned TIMESTAMP,
+                PRIMARY KEY (chat_id, user_id)
+            )
+        ''')
+
+        # Chat settings table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS chat_settings (
+                chat_id INTEGER PRIMARY KEY,
+                warn_mode TEXT DEFAULT 'mute',
+                warn_limit INTEGER DEFAULT 3,
+                warn_time TEXT DEFAULT 'off',
+                welcome_msg TEXT,
+                rules_msg TEXT
+            )
+        ''')
+
+        # Custom commands table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS custom_commands (
+                chat_id INTEGER,
+                command TEXT,
+                response TEXT,
+                PRIMARY KEY (chat_id, command)
+            )
+        ''')
+
+        # Banned users table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS banned_users (
+                chat_id INTEGER,
+                user_id INTEGER,
+                banned_by INTEGER,
+                ban_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (chat_id, user_id)
+            )
+        ''')
+
+        # Link allow/deny lists
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS link_rules (
+                chat_id INTEGER,
+                domain TEXT,
+                allowed INTEGER,
+                PRIMARY KEY (chat_id, domain)
+            )
+        ''')
+
+        # Warning expiry sweeps and lazy expiry scan by (chat_id, last_warned)
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_warnings_last_warned
+            ON warnings (chat_id, last_warned)
+        ''')
+
+        # Keyset paging: /banlist newest first, /cmds in creation order
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_banned_users_ban_time
+            ON banned_users (chat_id, ban_time, user_id)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_custom_commands_chat
+            ON custom_commands (chat_id)
+        ''')
+
+        # Recent joins, for banning everyone who joined during a raid
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS member_joins (
+                chat_id INTEGER,
+                user_id INTEGER,
+                joined_at TIMESTAMP,
+                PRIMARY KEY (chat_id, user_id)
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_member_joins_joined_at
+            ON member_joins (joined_at)
+        ''')
+
+        # User directory, fed from every update, for resolving @username
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT COLLATE NOCASE,
+                first_name TEXT,
+                last_seen TIMESTAMP
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_users_username
+            ON users (username, last_seen)
+        ''')
+
+
+# Timestamps were datetime.now() text (local time); they become integer Unix
+# seconds. Rows are converted in rowid ranges of MIGRATION_BATCH, one commit per
+# batch, and only rows still holding text are touched.
+MIGRATION_BATCH = int(os.environ.get('MIGRATION_BATCH', 5000))
+_TIMESTAMP_COLUMNS = (
+    ('warnings', 'last_warned'),
+    ('banned_users', 'ban_time'),
+    ('member_joins', 'joined_at'),
+    ('users', 'last_seen'),
+)
+
+
+def _migration_epoch_timestamps(conn):
+    for table, column in _TIMESTAMP_COLUMNS:
+        batch_end = f'SELECT max(rowid) FROM (SELECT rowid FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?)'
+        convert = f'''
+            UPDATE {table} SET {column} = coalesce(CAST(strftime('%s', {column}, 'utc') AS INTEGER), 0)
+            WHERE rowid > ? AND rowid <= ? AND typeof({column}) = 'text'
+        '''
+        last, converted = -2 ** 63, 0
+        while True:
+            upper = conn.execute(batch_end, (last, MIGRATION_BATCH)).fetchone()[0]
+            if upper is None:
+                break
+            with conn:
+                converted += conn.execute(convert, (last, upper)).rowcount
+            last = upper
+        logger.info(f"Converted {converted} {table}.{column} timestamps")
+
+
+def _migration_time_indexes(conn):
+    with conn:
+        # /banrecent: recent joins of one chat
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_member_joins_chat_joined_at
+            ON member_joins (chat_id, joined_at)
+        ''')
+
+
+def _migration_mod_actions(conn):
+    with conn:
+        # Moderation actions waiting for, or done by, the action workers.
+        # idempotency_key identifies the update that caused the action.
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS mod_actions (
+                id INTEGER PRIMARY KEY,
+                idempotency_key TEXT UNIQUE,
+                chat_id INTEGER,
+                user_id INTEGER,
+                action TEXT,
+                reason TEXT,
+                until_date INTEGER,
+                issued_by INTEGER,
+                status TEXT DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                next_attempt INTEGER,
+                created_at INTEGER,
+                last_error TEXT
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_mod_actions_due
+            ON mod_actions (status, next_attempt)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_mod_actions_created_at
+            ON mod_actions (status, created_at)
+        ''')
+
+
+_MIGRATIONS = (
+    _migration_initial_schema,
+    _migration_epoch_timestamps,
+    _migration_time_indexes,
+    _migration_mod_actions,
+)
+
+
+def init_db():
+    conn = get_connection()
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number in range(version, len(_MIGRATIONS)):
+        migration = _MIGRATIONS[number]
+        logger.info(f"Applying migration {number + 1}: {migration.__name__}")
+        migration(conn)
+        conn.execute(f'PRAGMA user_version = {number + 1}')
+    if version < len(_MIGRATIONS):
+        logger.info(f"Database schema at version {len(_MIGRATIONS)}")
+
+
+# Queries
+_SQL_GET_WARNINGS = '''
+    SELECT warnings FROM warnings
+    WHERE chat_id = ? AND user_id = ? AND last_warned >= ?
+'''
+_SQL_SET_WARNINGS = '''
+    INSERT OR REPLACE INTO warnings (chat_id, user_id, warnings, last_warned)
+    VALUES (?, ?, ?, ?)
+'''
+_SQL_INCREMENT_WARNINGS = '''
+    INSERT INTO warnings (chat_id, user_id, warnings, last_warned)
+    VALUES (?, ?, 1, ?)
+    ON CONFLICT (chat_id, user_id) DO UPDATE
+    SET warnings = CASE WHEN last_warned < ? THEN 1 ELSE warnings + 1 END,
+        last_warned = excluded.last_warned
+    RETURNING warnings
+'''
+_SQL_DECREMENT_WARNINGS = '''
+    UPDATE warnings SET warnings = warnings - 1
+    WHERE chat_id = ? AND user_id = ? AND warnings > 0 AND last_warned >= ?
+    RETURNING warnings
+'''
+_SQL_WARN_EXPIRY_CHATS = "SELECT chat_id, warn_time FROM chat_settings WHERE warn_time != 'off'"
+_SQL_DELETE_EXPIRED_WARNINGS = '''
+    DELETE FROM warnings WHERE rowid IN (
+        SELECT rowid FROM warnings WHERE chat_id = ? AND last_warned < ? LIMIT ?
+    )
+'''
+_SQL_RESET_WARNINGS = 'DELETE FROM warnings WHERE chat_id = ? AND user_id = ?'
+_SQL_RESET_CHAT_WARNINGS = 'DELETE FROM warnings WHERE chat_id = ?'
+_SQL_GET_SETTINGS = 'SELECT * FROM chat_settings WHERE chat_id = ?'
+_SQL_SET_SETTINGS = '''
+    INSERT OR REPLACE INTO chat_settings
+    (chat_id, warn_mode, warn_limit, warn_time, welcome_msg, rules_msg)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+_SQL_ADD_COMMAND = '''
+    INSERT OR REPLACE INTO custom_commands (chat_id, command, response)
+    VALUES (?, ?, ?)
+'''
+_SQL_GET_ALL_COMMANDS = 'SELECT command, response FROM custom_commands WHERE chat_id = ?'
+_SQL_COMMANDS_NEXT_PAGE = '''
+    SELECT rowid, command, response FROM custom_commands WHERE chat_id = ? AND rowid > ?
+    ORDER BY rowid ASC LIMIT ?
+'''
+_SQL_COMMANDS_PREVIOUS_PAGE = '''
+    SELECT rowid, command, response FROM custom_commands WHERE chat_id = ? AND rowid < ?
+    ORDER BY rowid DESC LIMIT ?
+'''
+_SQL_DELETE_COMMAND = 'DELETE FROM custom_commands WHERE chat_id = ? AND command = ?'
+_SQL_BAN_USER = '''
+    INSERT OR REPLACE INTO banned_users (chat_id, user_id, banned_by, ban_time)
+    VALUES (?, ?, ?, ?)
+'''
+_SQL_UNBAN_USER = 'DELETE FROM banned_users WHERE chat_id = ? AND user_id = ?'
+_SQL_IS_BANNED = 'SELECT 1 FROM banned_users WHERE chat_id = ? AND user_id = ?'
+_SQL_GET_BANNED = 'SELECT user_id, banned_by, ban_time FROM banned_users WHERE chat_id = ?'
+_SQL_BANNED_FIRST_PAGE = '''
+    SELECT user_id, banned_by, ban_time FROM banned_users WHERE chat_id = ?
+    ORDER BY ban_time DESC, user_id DESC LIMIT ?
+'''
+_SQL_BANNED_OLDER_PAGE = '''
+    SELECT user_id, banned_by, ban_time FROM banned_users WHERE chat_id = ? AND (ban_time, user_id) < (?, ?)
+    ORDER BY ban_time DESC, user_id DESC LIMIT ?
+'''
+_SQL_BANNED_NEWER_PAGE = '''
+    SELECT user_id, banned_by, ban_time FROM banned_users WHERE chat_id = ? AND (ban_time, user_id) > (?, ?)
+    ORDER BY ban_time ASC, user_id ASC LIMIT ?
+'''
+_SQL_RECORD_JOIN = 'INSERT OR REPLACE INTO member_joins (chat_id, user_id, joined_at) VALUES (?, ?, ?)'
+_SQL_GET_RECENT_JOINS = 'SELECT user_id FROM member_joins WHERE chat_id = ? AND joined_at >= ? ORDER BY joined_at'
+_SQL_DELETE_OLD_JOINS = '''
+    DELETE FROM member_joins WHERE rowid IN (
+        SELECT rowid FROM member_joins WHERE joined_at < ? LIMIT ?
+    )
+'''
+# Unchanged users match the WHERE of DO UPDATE as false, so they leave the
+# page untouched and an all-unchanged batch commits nothing
+_SQL_SAVE_USER = '''
+    INSERT INTO users (user_id, username, first_name, last_seen) VALUES (?, ?, ?, ?)
+    ON CONFLICT (user_id) DO UPDATE
+    SET username = excluded.username, first_name = excluded.first_name, last_seen = excluded.last_seen
+    WHERE username IS NOT excluded.username OR first_name IS NOT excluded.first_name OR last_seen < ?
+'''
+_SQL_FIND_USERNAME = '''
+    SELECT user_id, username, first_name FROM users WHERE username = ?
+    ORDER BY last_seen DESC LIMIT 1
+'''
+_SQL_ENQUEUE_MOD_ACTION = '''
+    INSERT INTO mod_actions
+    (idempotency_key, chat_id, user_id, action, reason, until_date, issued_by, next_attempt, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (idempotency_key) DO NOTHING
+    RETURNING id
+'''
+# Claiming leases the action until next_attempt; a running action whose lease
+# ran out (its worker died) is due again like a pending one
+_SQL_CLAIM_MOD_ACTION = '''
+    UPDATE mod_actions SET status = 'running', attempts = attempts + 1, next_attempt = ?
+    WHERE id = (
+        SELECT id FROM mod_actions WHERE status IN ('pending', 'running') AND next_attempt <= ?
+        ORDER BY next_attempt LIMIT 1
+    )
+    RETURNING id, chat_id, user_id, action, reason, until_date, issued_by, attempts
+'''
+_SQL_NEXT_MOD_ACTION_DUE = "SELECT min(next_attempt) FROM mod_actions WHERE status IN ('pending', 'running')"
+_SQL_FINISH_MOD_ACTION = 'UPDATE mod_actions SET status = ?, next_attempt = ?, last_error = ? WHERE id = ?'
+_SQL_DELETE_OLD_MOD_ACTIONS = '''
+    DELETE FROM mod_actions WHERE rowid IN (
+        SELECT rowid FROM mod_actions WHERE status IN ('done', 'failed') AND created_at < ? LIMIT ?
+    )
+'''
+_SQL_GET_LINK_RULES = 'SELECT domain, allowed FROM link_rules WHERE chat_id = ?'
+_SQL_SET_LINK_RULE = 'INSERT OR REPLACE INTO link_rules (chat_id, domain, allowed) VALUES (?, ?, ?)'
+_SQL_DELETE_LINK_RULE = 'DELETE FROM link_rules WHERE chat_id = ? AND domain = ?'
+
+DEFAULT_SETTINGS = {
+    'warn_mode': 'mute',
+    'warn_limit': 3,
+    'warn_time': 'off',
+    'welcome_msg': None,
+    'rules_msg': None
+}
+
+
+# Custom command index: chat_id -> {normalized trigger: response}, LRU across
+# chats. Loaded lazily on the DB thread; lookups from the event loop are a
+# single dict probe, and add/delete write through to loaded chats.
+_command_index = OrderedDict()
+_command_index_lock = threading.Lock()
+
+
+def normalize_trigger(text):
+    return text.strip().lower()
+
+
+def get_command_index(chat_id):
+    with _command_index_lock:
+        index = _command_index.get(chat_id)
+        if index is not None:
+            _command_index.move_to_end(chat_id)
+        return index
+
+
+def load_command_index(chat_id):
+    index = get_command_index(chat_id)
+    if index is not None:
+        return index
+
+    rows = get_connection().execute(_SQL_GET_ALL_COMMANDS, (chat_id,)).fetchall()
+    index = {normalize_trigger(command): response for command, response in rows}
+    with _command_index_lock:
+        _command_index[chat_id] = index
+        while len(_command_index) > COMMAND_INDEX_CHATS:
+            _command_index.popitem(last=False)
+    return index
+
+
+# Chat settings cache: chat_id -> settings dict, LRU across chats. Chats without
+# a row are cached with the defaults, which are never written to the database;
+# set_chat_settings writes through.
+_settings_cache = OrderedDict()
+_settings_lock = threading.Lock()
+_settings_stats = {'hits': 0, 'misses': 0}
+
+
+def settings_cache_stats():
+    with _settings_lock:
+        return dict(_settings_stats, size=len(_settings_cache))
+
+
+def get_cached_chat_settings(chat_id):
+    with _settings_lock:
+        settings = _settings_cache.get(chat_id)
+        if settings is None:
+            return None
+        _settings_cache.move_to_end(chat_id)
+        _settings_stats['hits'] += 1
+        return dict(settings)
+
+
+def _cache_chat_settings(chat_id, settings):
+    with _settings_lock:
+        _settings_cache[chat_id] = dict(settings)
+        _settings_cache.move_to_end(chat_id)
+        while len(_settings_cache) > SETTINGS_CACHE_CHATS:
+            _settings_cache.popitem(last=False)
+
+
+# Link rules cache: chat_id -> (allowed domains, denied domains) as frozensets
+_link_rules = OrderedDict()
+_link_rules_lock = threading.Lock()
+
+
+def get_cached_link_rules(chat_id):
+    with _link_rules_lock:
+        rules = _link_rules.get(chat_id)
+        if rules is not None:
+            _link_rules.move_to_end(chat_id)
+        return rules
+
+
+def load_link_rules(chat_id):
+    rules = get_cached_link_rules(chat_id)
+    if rules is not None:
+        return rules
+
+    rows = get_connection().execute(_SQL_GET_LINK_RULES, (chat_id,)).fetchall()
+    rules = (
+        frozenset(domain for domain, allowed in rows if allowed),
+        frozenset(domain for domain, allowed in rows if not allowed),
+    )
+    with _link_rules_lock:
+        _link_rules[chat_id] = rules
+        while len(_link_rules) > SETTINGS_CACHE_CHATS:
+            _link_rules.popitem(last=False)
+    return rules
+
+
+# User directory cache: user_id -> (username, first_name, time last written),
+# LRU, plus lowercased username -> user_id for the cached users. Updates are
+# checked against it on the event loop, so users whose names have not changed
+# are never sent to the DB thread; lookups only go to SQLite on a miss.
+_users = OrderedDict()
+_usernames = {}
+_users_lock = threading.Lock()
+
+
+def _cache_user(user_id, username, first_name, written):
+    # Caller holds _users_lock
+    old = _users.pop(user_id, None)
+    if old and old[0] and _usernames.get(old[0].lower()) == user_id:
+        del _usernames[old[0].lower()]
+    _users[user_id] = (username, first_name, written)
+    if username:
+        _usernames[username.lower()] = user_id
+    while len(_users) > USER_CACHE_SIZE:
+        evicted, (name, _, _) = _users.popitem(last=False)
+        if name and _usernames.get(name.lower()) == evicted:
+            del _usernames[name.lower()]
+
+
+def users_to_save(users):
+    # users: (user_id, username, first_name) seen in an update. Returns the
+    # ones that are new, renamed or due a last_seen refresh, and caches them.
+    now = time.time()
+    changed = []
+    with _users_lock:
+        for user_id, username, first_name in users:
+            cached = _users.get(user_id)
+            if (cached and cached[0] == username and cached[1] == first_name
+                    and now - cached[2] < USER_SEEN_INTERVAL):
+                _users.move_to_end(user_id)
+                continue
+            _cache_user(user_id, username, first_name, now)
+            changed.append((user_id, username, first_name))
+    return changed
+
+
+def save_users(users):
+    now = int(time.time())
+    stale = now - USER_SEEN_INTERVAL
+    rows = [(user_id, username, first_name, now, stale) for user_id, username, first_name in users]
+    _buffered_write(_SQL_SAVE_USER, rows, many=True)
+
+
+def get_cached_user_id(username):
+    with _users_lock:
+        user_id = _usernames.get(username.lstrip('@').lower())
+        if user_id is not None:
+            _users.move_to_end(user_id)
+        return user_id
+
+
+def find_user_id(username):
+    # user_id for @username, or None if the bot has never seen it
+    username = username.lstrip('@')
+    user_id = get_cached_user_id(username)
+    if user_id is not None:
+        return user_id
+
+    row = get_connection().execute(_SQL_FIND_USERNAME, (username,)).fetchone()
+    if row is None:
+        return None
+    with _users_lock:
+        if row[0] not in _users:
+            # Cached as written now, so the next sighting does not rewrite it
+            _cache_user(row[0], row[1], row[2], time.time())
+    return row[0]
+
+
+def user_directory_stats():
+    with _users_lock:
+        return {'users': len(_users), 'usernames': len(_usernames)}
+
+
+def _write(sql, params):
+    # Immediate commit; also commits any buffered writes on this connection
+    cursor = get_connection().execute(sql, params)
+    _write_stats['writes'] += 1
+    flush_writes()
+    return cursor
+
+
+# Database functions
+# Warning expiry: warn_time values like 30m, 6h, 3d or 2w
+_DURATION_RE = re.compile(r'^(\d+)([mhdw])$')
+_DURATION_UNITS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+# Rows deleted per transaction by the expiry sweeper
+WARN_SWEEP_BATCH = int(os.environ.get('WARN_SWEEP_BATCH', 500))
+
+
+def parse_duration(value):
+    # Seconds, or None for 'off' and anything unparseable
+    match = _DURATION_RE.match((value or '').strip().lower())
+    if not match or int(match.group(1)) == 0:
+        return None
+    return int(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
+
+def _warn_cutoff(chat_id, now):
+    # Warnings older than the cutoff are treated as expired
+    ttl = parse_duration(get_chat_settings(chat_id)['warn_time'])
+    return now - ttl if ttl else 0
+
+
+def get_user_warnings(chat_id, user_id):
+    cutoff = _warn_cutoff(chat_id, int(time.time()))
+    result = get_connection().execute(_SQL_GET_WARNINGS, (chat_id, user_id, cutoff)).fetchone()
+    return result[0] if result else 0
+
+
+def update_user_warnings(chat_id, user_id, warnings):
+    _buffered_write(_SQL_SET_WARNINGS, (chat_id, user_id, warnings, int(time.time())))
+
+
+# Atomic warning counters: each is a single statement, so concurrent updates
+# for the same user can never lose an increment.
+def increment_warnings(chat_id, user_id):
+    now = int(time.time())
+    params = (chat_id, user_id, now, _warn_cutoff(chat_id, now))
+    rows = _buffered_write(_SQL_INCREMENT_WARNINGS, params, returning=True)
+    return rows[0][0]
+
+
+def decrement_warnings(chat_id, user_id):
+    # Returns the new count, or None if the user had no warnings to remove
+    params = (chat_id, user_id, _warn_cutoff(chat_id, int(time.time())))
+    rows = _buffered_write(_SQL_DECREMENT_WARNINGS, params, returning=True)
+    return rows[0][0] if rows else None
+
+
+def reset_warnings(chat_id, user_id):
+    _buffered_write(_SQL_RESET_WARNINGS, (chat_id, user_id))
+    return 0
+
+
+def get_warn_expiry_chats():
+    # (chat_id, ttl seconds) for every chat with warn_time enabled
+    rows = get_connection().execute(_SQL_WARN_EXPIRY_CHATS).fetchall()
+    return [(chat_id, parse_duration(warn_time)) for chat_id, warn_time in rows
+            if parse_duration(warn_time)]
+
+
+def delete_expired_warnings(chat_id, ttl, limit=WARN_SWEEP_BATCH):
+    # One bounded batch per transaction; returns the number of rows deleted
+    cutoff = int(time.time()) - ttl
+    return _write(_SQL_DELETE_EXPIRED_WARNINGS, (chat_id, cutoff, limit)).rowcount
+
+
+def reset_all_warnings(chat_id):
+    _write(_SQL_RESET_CHAT_WARNINGS, (chat_id,))
+
+
+def get_chat_settings(chat_id):
+    settings = get_cached_chat_settings(chat_id)
+    if settings is not None:
+        return settings
+
+    with _settings_lock:
+        _settings_stats['misses'] += 1
+    result = get_connection().execute(_SQL_GET_SETTINGS, (chat_id,)).fetchone()
+
+    if result:
+        settings = {
+            'warn_mode': result[1],
+            'warn_limit': result[2],
+            'warn_time': result[3],
+            'welcome_msg': result[4],
+            'rules_msg': result[5]
+        }
+    else:
+        # Default settings (only stored once an admin changes something)
+        settings = dict(DEFAULT_SETTINGS)
+    _cache_chat_settings(chat_id, settings)
+    return settings
+
+
+def set_chat_settings(chat_id, settings):
+    _write(_SQL_SET_SETTINGS, (chat_id, settings['warn_mode'], settings['warn_limit'],
+                               settings['warn_time'], settings['welcome_msg'], settings['rules_msg']))
+    _cache_chat_settings(chat_id, settings)
+
+
+def add_custom_command(chat_id, command, response):
+    _write(_SQL_ADD_COMMAND, (chat_id, command.lower(), response))
+    with _command_index_lock:
+        index = _command_index.get(chat_id)
+        if index is not None:
+            index[normalize_trigger(command)] = response
+
+
+def get_custom_command(chat_id, command):
+    return load_command_index(chat_id).get(normalize_trigger(command))
+
+
+def get_all_custom_commands(chat_id):
+    return get_connection().execute(_SQL_GET_ALL_COMMANDS, (chat_id,)).fetchall()
+
+
+def delete_custom_command(chat_id, command):
+    _write(_SQL_DELETE_COMMAND, (chat_id, command.lower()))
+    with _command_index_lock:
+        index = _command_index.get(chat_id)
+        if index is not None:
+            index.pop(normalize_trigger(command), None)
+
+
+def ban_user(chat_id, user_id, banned_by):
+    _buffered_write(_SQL_BAN_USER, (chat_id, user_id, banned_by, int(time.time())))
+
+
+def unban_user(chat_id, user_id):
+    return _buffered_write(_SQL_UNBAN_USER, (chat_id, user_id)).rowcount > 0
+
+
+def ban_users(chat_id, user_ids, banned_by):
+    # Bulk ban: one executemany in the open transaction
+    now = int(time.time())
+    _buffered_write(_SQL_BAN_USER, [(chat_id, user_id, banned_by, now) for user_id in user_ids], many=True)
+
+
+def unban_users(chat_id, user_ids):
+    return _buffered_write(_SQL_UNBAN_USER, [(chat_id, user_id) for user_id in user_ids], many=True).rowcount
+
+
+def is_user_banned(chat_id, user_id):
+    return get_connection().execute(_SQL_IS_BANNED, (chat_id, user_id)).fetchone() is not None
+
+
+def get_banned_users(chat_id):
+    return get_connection().execute(_SQL_GET_BANNED, (chat_id,)).fetchall()
+
+
+# Keyset pagination: pages start after the last (or before the first) row the
+# user saw, so each page is one index range scan however deep it is. Both
+# return (rows in display order, whether more rows follow in that direction).
+def get_banned_page(chat_id, cursor=None, newer=False, limit=20):
+    # Newest bans first; cursor is the (ban_time, user_id) to page from
+    conn = get_connection()
+    if cursor is None:
+        rows = conn.execute(_SQL_BANNED_FIRST_PAGE, (chat_id, limit + 1)).fetchall()
+    elif newer:
+        rows = conn.execute(_SQL_BANNED_NEWER_PAGE, (chat_id, *cursor, limit + 1)).fetchall()
+    else:
+        rows = conn.execute(_SQL_BANNED_OLDER_PAGE, (chat_id, *cursor, limit + 1)).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if newer:
+        rows.reverse()
+    return rows, more
+
+
+def get_custom_commands_page(chat_id, cursor=0, previous=False, limit=20):
+    # Commands in the order they were added; cursor is a rowid
+    sql = _SQL_COMMANDS_PREVIOUS_PAGE if previous else _SQL_COMMANDS_NEXT_PAGE
+    rows = get_connection().execute(sql, (chat_id, cursor, limit + 1)).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if previous:
+        rows.reverse()
+    return rows, more
+
+
+def record_joins(chat_id, user_ids):
+    now = int(time.time())
+    _buffered_write(_SQL_RECORD_JOIN, [(chat_id, user_id, now) for user_id in user_ids], many=True)
+
+
+def get_recent_joins(chat_id, seconds):
+    since = int(time.time()) - seconds
+    return [row[0] for row in get_connection().execute(_SQL_GET_RECENT_JOINS, (chat_id, since))]
+
+
+def delete_old_joins(seconds, limit=WARN_SWEEP_BATCH):
+    # One bounded batch per transaction; returns the number of rows deleted
+    cutoff = int(time.time()) - seconds
+    return _write(_SQL_DELETE_OLD_JOINS, (cutoff, limit)).rowcount
+
+
+# Moderation action queue (see moderation.py). Enqueueing and finishing commit
+# right away, so an accepted action survives a restart and a finished one is
+# not run again.
+def enqueue_mod_action(key, chat_id, user_id, action, reason, until_date, issued_by):
+    # Returns the new action's id, or None if the key was already queued
+    now = int(time.time())
+    params = (key, chat_id, user_id, action, reason, until_date, issued_by, now, now)
+    rows = _buffered_write(_SQL_ENQUEUE_MOD_ACTION, params, returning=True)
+    flush_writes()
+    return rows[0][0] if rows else None
+
+
+def claim_mod_action(lease):
+    # (the next due action, None) or (None, seconds until one is due or None)
+    now = int(time.time())
+    rows = _buffered_write(_SQL_CLAIM_MOD_ACTION, (now + lease, now), returning=True)
+    if rows:
+        return rows[0], None
+    due = get_connection().execute(_SQL_NEXT_MOD_ACTION_DUE).fetchone()[0]
+    return None, None if due is None else max(due - now, 0)
+
+
+def finish_mod_action(action_id, status, delay=0, error=None):
+    # status: 'done', 'failed', or 'pending' to retry after delay seconds
+    _buffered_write(_SQL_FINISH_MOD_ACTION, (status, int(time.time()) + delay, error, action_id))
+    flush_writes()
+
+
+def delete_old_mod_actions(seconds, limit=WARN_SWEEP_BATCH):
+    # One bounded batch per transaction; returns the number of rows deleted
+    cutoff = int(time.time()) - seconds
+    return _write(_SQL_DELETE_OLD_MOD_ACTIONS, (cutoff, limit)).rowcount
+
+
+def set_link_rule(chat_id, domain, allowed):
+    _write(_SQL_SET_LINK_RULE, (chat_id, domain, int(allowed)))
+    with _link_rules_lock:
+        _link_rules.pop(chat_id, None)
+
+
+def delete_link_rule(chat_id, domain):
+    deleted = _write(_SQL_DELETE_LINK_RULE, (chat_id, domain)).rowcount > 0
+    with _link_rules_lock:
+        _link_rules.pop(chat_id, None)
+    return deleted
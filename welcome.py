@@ -0,0 +1,61 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Welcome coalescing: the first join in a chat opens a window, every join that
+# arrives before it closes goes into the same batch, and the batch is sent as
+# one message when the window ends. Members are kept as User objects and only
+# rendered at send time; past max_mentions they are counted instead.
+class WelcomeBatcher:
+    def __init__(self, send, window=5.0, max_mentions=10):
+        self.send = send  # async send(bot, chat_id, title, members, overflow)
+        self.window = window
+        self.max_mentions = max_mentions
+        self._batches = {}  # chat_id -> open batch
+        self._tasks = {}  # chat_id -> task sending the batch when its window ends
+        self.joins = 0
+        self.messages = 0
+
+    def add(self, bot, chat_id, title, members):
+        batch = self._batches.get(chat_id)
+        if batch is None:
+            batch = {'bot': bot, 'title': title, 'members': {}, 'overflow': 0}
+            self._batches[chat_id] = batch
+            self._tasks[chat_id] = asyncio.ensure_future(self._send_later(chat_id))
+        batch['title'] = title
+
+        for member in members:
+            self.joins += 1
+            if member.id in batch['members']:
+                continue
+            if len(batch['members']) < self.max_mentions:
+                batch['members'][member.id] = member
+            else:
+                batch['overflow'] += 1
+
+    def pending(self):
+        return len(self._batches)
+
+    async def _send_later(self, chat_id):
+        await asyncio.sleep(self.window)
+        del self._tasks[chat_id]
+        await self._send(chat_id, self._batches.pop(chat_id))
+
+    async def _send(self, chat_id, batch):
+        self.messages += 1
+        try:
+            await self.send(batch['bot'], chat_id, batch['title'],
+                            list(batch['members'].values()), batch['overflow'])
+        except Exception as e:
+            logger.error(f"Error sending welcome in {chat_id}: {e}")
+
+    async def flush(self):
+        # Send every open batch now (used on shutdown)
+        batches, self._batches = self._batches, {}
+        tasks, self._tasks = self._tasks, {}
+        for task in tasks.values():
+            task.cancel()
+        for chat_id, batch in batches.items():
+            await self._send(chat_id, batch)